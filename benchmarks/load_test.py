@@ -0,0 +1,578 @@
+"""Drive bot.py against local stand-ins for Lavalink and Discord.
+
+A fake Lavalink (REST loadtracks, player updates and the websocket event
+stream) runs on localhost, and the Discord gateway and REST surface are
+replaced by in-process fakes. Commands go through bot.invoke and buttons
+through their view's interaction_check, so a run with TRACE_PATH set
+records a trace benchmarks/replay.py can play back. Each simulated guild joins voice, runs !play
+for a single track and a playlist, picks a !search result, presses the
+panel buttons and then lets tracks end on their own. The real command and
+event handlers in bot.py do all the work.
+
+Usage: python benchmarks/load_test.py [--guilds N] [--seconds S] [--track-ms MS]
+       [--lavalink-delay S] [--mirror-delay S]
+"""
+
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+LAVALINK_PORT = free_port()
+WORKDIR = tempfile.mkdtemp(prefix="bot-load-")
+os.environ.update(
+    LAVALINK_NODES=f"http://127.0.0.1:{LAVALINK_PORT}|loadtest",
+    SEARCH_CACHE_PATH=os.path.join(WORKDIR, "search_cache.db"),
+    STATE_PATH=os.path.join(WORKDIR, "guild_state.db"),
+)
+# Measure the handlers, not admission control, unless asked to.
+os.environ.setdefault("ADMIT_MAX_PLAYERS", "1000000")
+os.environ["SYNC_COMMANDS"] = "0"
+
+import discord  # noqa: E402
+import wavelink  # noqa: E402
+from discord.ext import commands  # noqa: E402
+
+import bot  # noqa: E402
+
+SEARCH_RESULTS = 5
+PLAYLIST_SIZE = 60
+
+outbound: Counter = Counter()
+latencies: dict[str, list[float]] = defaultdict(list)
+
+
+class FakeLavalink:
+    """Just enough of the Lavalink v4 API for wavelink and bot.py.
+
+    Tracks "play" for track_ms and then end with reason "finished"; pausing
+    holds the remaining time. Every load waits `delay` seconds to stand in
+    for the network and the source lookup; playing a Spotify track waits
+    another `mirror_delay` for the YouTube lookup LavaSrc does at that point.
+    """
+
+    def __init__(self, track_ms: int, delay: float, mirror_delay: float = 0.0):
+        self.track_ms = track_ms
+        self.delay = delay
+        self.mirror_delay = mirror_delay
+        self.socket: web.WebSocketResponse | None = None
+        self.tracks: dict[str, dict] = {}
+        self.players: dict[int, dict] = {}
+        self.loads = 0
+        self.starts = 0
+        self.ends = 0
+        self.app = web.Application()
+        self.app.add_routes(
+            [
+                web.get("/v4/websocket", self.websocket),
+                web.get("/v4/info", self.info),
+                web.get("/v4/stats", self.stats),
+                web.get("/v4/loadtracks", self.load_tracks),
+                web.patch("/v4/sessions/{session}", self.update_session),
+                web.patch("/v4/sessions/{session}/players/{guild}", self.update_player),
+                web.delete(
+                    "/v4/sessions/{session}/players/{guild}", self.destroy_player
+                ),
+            ]
+        )
+
+    def track(self, key: str, source: str) -> dict:
+        encoded = f"fake:{source}:{key}"
+        payload = self.tracks.get(encoded)
+        if payload is None:
+            payload = self.tracks[encoded] = {
+                "encoded": encoded,
+                "info": {
+                    "identifier": key,
+                    "isSeekable": True,
+                    "author": f"Artist {hash(key) % 100}",
+                    "length": self.track_ms,
+                    "isStream": False,
+                    "position": 0,
+                    "title": f"Track {key}",
+                    "uri": f"https://example.com/{source}/{key}",
+                    "artworkUrl": None,
+                    "isrc": f"LT{abs(hash(key)) % 10**10:010d}",
+                    "sourceName": source,
+                },
+                "pluginInfo": {},
+                "userData": {},
+            }
+        return payload
+
+    async def emit(self, guild_id: int, event: str, track: dict, **extra):
+        if self.socket is None or self.socket.closed:
+            return
+        await self.socket.send_json(
+            {
+                "op": "event",
+                "type": event,
+                "guildId": str(guild_id),
+                "track": track,
+                **extra,
+            }
+        )
+
+    def finish(self, guild_id: int):
+        player = self.players.get(guild_id)
+        if player is None or player["track"] is None:
+            return
+        track, player["track"], player["timer"] = player["track"], None, None
+        self.ends += 1
+        asyncio.create_task(
+            self.emit(guild_id, "TrackEndEvent", track, reason="finished")
+        )
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.socket = ws
+        await ws.send_json({"op": "ready", "resumed": False, "sessionId": "loadtest"})
+        async for _ in ws:
+            pass
+        return ws
+
+    async def info(self, request):
+        return web.json_response(
+            {
+                "version": {"semver": "4.0.0"},
+                "sourceManagers": ["youtube", "spotify"],
+                "filters": [],
+                "plugins": [],
+            }
+        )
+
+    async def stats(self, request):
+        playing = sum(1 for p in self.players.values() if p["track"] is not None)
+        return web.json_response(
+            {
+                "players": len(self.players),
+                "playingPlayers": playing,
+                "uptime": 0,
+                "memory": {"free": 0, "used": 0, "allocated": 0, "reservable": 0},
+                "cpu": {"cores": 1, "systemLoad": 0.1, "lavalinkLoad": 0.05},
+            }
+        )
+
+    async def load_tracks(self, request):
+        self.loads += 1
+        await asyncio.sleep(self.delay)
+        identifier = request.query["identifier"]
+        if "/playlist/" in identifier:
+            name = identifier.rsplit("/", 1)[-1]
+            tracks = [
+                self.track(f"{name}-{i}", "spotify") for i in range(PLAYLIST_SIZE)
+            ]
+            return web.json_response(
+                {
+                    "loadType": "playlist",
+                    "data": {
+                        "info": {"name": name, "selectedTrack": -1},
+                        "pluginInfo": {},
+                        "tracks": tracks,
+                    },
+                }
+            )
+        query = identifier.partition(":")[2] or identifier
+        tracks = [self.track(f"{query}#{i}", "youtube") for i in range(SEARCH_RESULTS)]
+        return web.json_response({"loadType": "search", "data": tracks})
+
+    async def update_session(self, request):
+        return web.json_response(await request.json())
+
+    async def update_player(self, request):
+        guild_id = int(request.match_info["guild"])
+        data = await request.json()
+        player = self.players.setdefault(
+            guild_id,
+            {"track": None, "timer": None, "remaining": 0.0, "paused": False},
+        )
+        loop = asyncio.get_running_loop()
+
+        if "paused" in data and data["paused"] != player["paused"]:
+            player["paused"] = data["paused"]
+            if player["timer"] is not None:
+                player["remaining"] = max(0.0, player["timer"].when() - loop.time())
+                player["timer"].cancel()
+                player["timer"] = None
+            if not player["paused"] and player["track"] is not None:
+                player["timer"] = loop.call_later(
+                    player["remaining"], self.finish, guild_id
+                )
+
+        update = data.get("track")
+        no_replace = request.query.get("noReplace") == "true"
+        if update is not None and not (no_replace and player["track"] is not None):
+            previous = player["track"]
+            if player["timer"] is not None:
+                player["timer"].cancel()
+                player["timer"] = None
+            encoded = update.get("encoded")
+            if encoded and encoded.startswith("fake:spotify:"):
+                await asyncio.sleep(self.mirror_delay)
+            if previous is not None:
+                self.ends += 1
+                reason = "replaced" if encoded else "stopped"
+                await self.emit(guild_id, "TrackEndEvent", previous, reason=reason)
+            player["track"] = self.tracks.get(encoded) if encoded else None
+            if player["track"] is not None:
+                self.starts += 1
+                player["remaining"] = self.track_ms / 1000
+                if not player["paused"]:
+                    player["timer"] = loop.call_later(
+                        player["remaining"], self.finish, guild_id
+                    )
+                await self.emit(guild_id, "TrackStartEvent", player["track"])
+
+        return web.json_response(
+            {
+                "guildId": str(guild_id),
+                "track": player["track"],
+                "volume": data.get("volume", 100),
+                "paused": player["paused"],
+                "state": {"time": 0, "position": 0, "connected": True, "ping": 0},
+                "voice": data.get("voice", {}),
+                "filters": {},
+            }
+        )
+
+    async def destroy_player(self, request):
+        player = self.players.pop(int(request.match_info["guild"]), None)
+        if player is not None and player["timer"] is not None:
+            player["timer"].cancel()
+        return web.Response(status=204)
+
+
+class FakeMessage:
+    def __init__(self, channel, content=None, embed=None, view=None, author=None):
+        self.id = random.getrandbits(62)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.embed = embed
+        self.view = view
+        self.components = [view] if view else []
+        self.attachments = []
+        self._state = bot.bot._connection
+
+    async def edit(
+        self, *, content=None, embed=None, view=discord.utils.MISSING, **kwargs
+    ):
+        outbound["edit"] += 1
+        if embed is not None:
+            self.embed = embed
+        if view is not discord.utils.MISSING:
+            self.view = view
+            self.components = [view] if view else []
+        return self
+
+    async def delete(self, **kwargs):
+        outbound["delete"] += 1
+
+
+class FakeTextChannel:
+    def __init__(self, guild):
+        self.id = guild.id + 1
+        self.guild = guild
+        self.name = "müzik"
+        self.views: list = []
+
+    async def send(self, content=None, *, embed=None, view=None, **kwargs):
+        outbound["send"] += 1
+        if view is not None:
+            self.views.append(view)
+        return FakeMessage(self, content, embed, view)
+
+    async def delete_messages(self, messages, **kwargs):
+        outbound["bulk_delete"] += 1
+
+    def permissions_for(self, member):
+        return discord.Permissions(manage_messages=True)
+
+    def last_view(self, cls):
+        return next(v for v in reversed(self.views) if isinstance(v, cls))
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild):
+        self.id = guild.id + 2
+        self.guild = guild
+        self.name = "Ses"
+
+    def _get_voice_client_key(self):
+        return self.guild.id, "guild_id"
+
+    async def connect(self, *, cls, timeout=60.0, reconnect=True, **kwargs):
+        player = cls(bot.bot, self)
+        bot.bot._connection._add_voice_client(self.guild.id, player)
+        await player.connect(timeout=timeout, reconnect=reconnect)
+        return player
+
+
+class FakeGuild:
+    """Stands in for the gateway: voice state changes are answered with the
+    VOICE_STATE_UPDATE / VOICE_SERVER_UPDATE pair Discord would send."""
+
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"Guild {guild_id}"
+        self.text = FakeTextChannel(self)
+        self.voice = FakeVoiceChannel(self)
+        self.member = SimpleNamespace(
+            id=guild_id + 3,
+            name=f"user{guild_id}",
+            bot=False,
+            guild=self,
+            voice=SimpleNamespace(channel=self.voice),
+        )
+        self.voice.members = [
+            self.member,
+            SimpleNamespace(id=1, name="bot", bot=True, guild=self),
+        ]
+        self.channel = None
+        self.me = SimpleNamespace(id=1)
+
+    @property
+    def voice_client(self):
+        return bot.bot._connection._get_voice_client(self.id)
+
+    async def change_voice_state(self, *, channel, **kwargs):
+        if channel is None:
+            before, self.channel = self.channel, None
+            member = SimpleNamespace(id=bot.bot.user.id, guild=self)
+            bot.bot.dispatch(
+                "voice_state_update",
+                member,
+                SimpleNamespace(channel=before),
+                SimpleNamespace(channel=None),
+            )
+            return
+        self.channel = channel
+        asyncio.create_task(self._voice_handshake(channel))
+
+    async def _voice_handshake(self, channel):
+        player = self.voice_client
+        await player.on_voice_state_update(
+            {"session_id": f"voice-{self.id}", "channel_id": channel.id}
+        )
+        await player.on_voice_server_update(
+            {
+                "token": "token",
+                "endpoint": "loadtest.discord.media",
+                "guild_id": self.id,
+            }
+        )
+
+
+class FakeResponse:
+    def __init__(self):
+        self.done = False
+
+    def is_done(self) -> bool:
+        return self.done
+
+    async def send_message(self, content=None, **kwargs):
+        outbound["interaction"] += 1
+        self.done = True
+        return SimpleNamespace(message_id=random.getrandbits(62))
+
+    async def edit_message(self, **kwargs):
+        outbound["interaction"] += 1
+        self.done = True
+
+
+class FakeInteraction:
+    def __init__(self, guild: FakeGuild, custom_id: str | None = None, user=None):
+        self.guild = guild
+        self.user = user or guild.member
+        self.channel = guild.text
+        self.data = {"custom_id": custom_id}
+        self.response = FakeResponse()
+        self.guild_id = guild.id
+
+    async def delete_original_response(self):
+        outbound["delete"] += 1
+
+
+class FakeContext(commands.Context):
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+def rss_kb() -> int:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+async def command(guild: FakeGuild, content: str, author=None):
+    message = FakeMessage(guild.text, content=content, author=author or guild.member)
+    ctx = await bot.bot.get_context(message, cls=FakeContext)
+    start = time.perf_counter()
+    await bot.bot.invoke(ctx)
+    latencies[f"!{ctx.command.name}"].append(time.perf_counter() - start)
+
+
+async def press(
+    guild: FakeGuild, name: str, item, custom_id: str | None = None, user=None
+):
+    # Same order as discord.py's view dispatch: the view's check, then the
+    # button callback.
+    interaction = FakeInteraction(guild, custom_id or item.custom_id, user)
+    start = time.perf_counter()
+    if await item.view.interaction_check(interaction):
+        await item.callback(interaction)
+    latencies[f"[{name}]"].append(time.perf_counter() - start)
+
+
+async def sample_loop_lag(samples: list[float], interval: float = 0.01):
+    while True:
+        expected = time.monotonic() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.monotonic() - expected))
+
+
+async def run_guild(guild: FakeGuild, rng: random.Random, ramp: float, until: float):
+    await asyncio.sleep(rng.random() * ramp)
+    await command(guild, f"!play song {rng.randrange(50)}")
+    await command(
+        guild, f"!play https://open.spotify.com/playlist/mix{rng.randrange(5)}"
+    )
+    await command(guild, f"!search artist {rng.randrange(20)}")
+    search_view = guild.text.last_view(bot.SearchView)
+    await press(guild, "search result", search_view.children[0], "1")
+
+    extra = guild.text.last_view(bot.ExtraControls)
+    for name in ("status", "volume_up", "shuffle"):
+        await press(guild, name, getattr(extra, name))
+    controls = bot.control_views[bot.MusicControls]
+    for name in ("pause_resume", "pause_resume", "queue_list", "skip"):
+        await press(guild, name, getattr(controls, name))
+
+    while time.monotonic() < until:
+        await asyncio.sleep(rng.uniform(0.5, 2.0))
+        await press(guild, "status", extra.status)
+
+
+def print_transitions():
+    count = bot.transition_stats["count"]
+    average = bot.transition_stats["total_ms"] / count if count else 0.0
+    print(
+        f"  track transitions {count}, avg {average:.1f} ms, "
+        f"max {bot.transition_stats['max_ms']:.1f} ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=15.0)
+    parser.add_argument("--track-ms", type=int, default=2000)
+    parser.add_argument("--lavalink-delay", type=float, default=0.02)
+    parser.add_argument("--mirror-delay", type=float, default=0.3)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # One simulated user clicks far more than the per-user buckets allow.
+    bot.throttle.limits = {scope: (1e9, 1e9) for scope in bot.throttle.limits}
+    lavalink = FakeLavalink(args.track_ms, args.lavalink_delay, args.mirror_delay)
+    runner = web.AppRunner(lavalink.app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", LAVALINK_PORT).start()
+
+    guilds = {1000 * (i + 1): FakeGuild(1000 * (i + 1)) for i in range(args.guilds)}
+    client = bot.bot
+    await client._async_setup_hook()
+    client._connection.user = SimpleNamespace(id=1, name="bot", bot=True)
+    client.get_guild = guilds.get
+    client.get_channel = lambda channel_id: next(
+        (g.voice for g in guilds.values() if g.voice.id == channel_id), None
+    )
+    await client.setup_hook()
+    while not bot.healthy_nodes():
+        await asyncio.sleep(0.05)
+
+    lag: list[float] = []
+    lag_task = asyncio.create_task(sample_loop_lag(lag))
+    gc.collect()
+    rss_before = rss_kb()
+
+    rng = random.Random(42)
+    ramp = min(2.0, args.seconds / 4)
+    started = time.monotonic()
+    until = started + args.seconds
+    await asyncio.gather(
+        *(
+            run_guild(g, random.Random(rng.random()), ramp, until)
+            for g in guilds.values()
+        )
+    )
+    gc.collect()
+    rss_peak = rss_kb()
+    for guild in guilds.values():
+        await press(guild, "stop", bot.control_views[bot.MusicControls].stop)
+    elapsed = time.monotonic() - started
+    lag_task.cancel()
+
+    print(
+        f"{args.guilds} guilds, {elapsed:.1f}s, track length {args.track_ms} ms, "
+        f"lavalink delay {args.lavalink_delay * 1000:.0f} ms"
+    )
+    print(f"  {'action':<18} {'count':>6} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, values in sorted(latencies.items()):
+        print(
+            f"  {name:<18} {len(values):>6} {percentile(values, 50) * 1000:9.2f} "
+            f"{percentile(values, 99) * 1000:9.2f}"
+        )
+    print_transitions()
+    sent = sum(outbound.values())
+    starts = max(1, lavalink.starts)
+    print(
+        f"  tracks started {lavalink.starts}, ended {lavalink.ends}, "
+        f"lavalink loads {lavalink.loads}"
+    )
+    print(
+        f"  outbound messages {sent} ({dict(outbound)}), "
+        f"{sent / starts:.2f} per track"
+    )
+    print(f"  memory {(rss_peak - rss_before) / args.guilds:.1f} kB RSS per guild")
+    print(
+        f"  loop lag p50 {percentile(lag, 50) * 1000:.2f} ms, "
+        f"p99 {percentile(lag, 99) * 1000:.2f} ms, max {max(lag, default=0) * 1000:.2f} ms"
+    )
+
+    await wavelink.Pool.close()
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
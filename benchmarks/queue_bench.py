@@ -0,0 +1,121 @@
+"""Compare wavelink's list-backed Queue with bot.IndexedQueue on a 10k queue.
+
+Usage: python benchmarks/queue_bench.py [size]
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import wavelink  # noqa: E402
+
+import bot  # noqa: E402
+
+OPERATIONS = 2000
+
+
+def make_track(i: int) -> wavelink.Playable:
+    return wavelink.Playable(
+        {
+            "encoded": f"QAAA{i:08d}" + "x" * 160,
+            "info": {
+                "identifier": f"id{i}",
+                "isSeekable": True,
+                "author": f"Artist {i % 500}",
+                "length": 180000,
+                "isStream": False,
+                "position": 0,
+                "title": f"Track number {i}",
+                "uri": f"https://example.com/watch?v={i}",
+                "artworkUrl": f"https://example.com/art/{i}.jpg",
+                "isrc": f"TR{i:010d}",
+                "sourceName": "spotify",
+            },
+            "pluginInfo": {"albumName": "Album", "artistUrl": "https://example.com"},
+        }
+    )
+
+
+def fill(queue: wavelink.Queue, size: int) -> float:
+    tracemalloc.start()
+    queue.put([make_track(i) for i in range(size)])
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / size
+
+
+def timed(label: str, func, rounds: int = OPERATIONS) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    elapsed = (time.perf_counter() - start) / rounds * 1e6
+    print(f"  {label:<22} {elapsed:10.2f} us/op")
+    return elapsed
+
+
+def list_move(queue: wavelink.Queue, start: int, stop: int, to: int):
+    moved = queue[start:stop]
+    del queue[start:stop]
+    for offset, track in enumerate(moved):
+        queue.put_at(to + offset, track)
+
+
+def list_page(queue: wavelink.Queue, start: int):
+    # What the old "Siradakiler" button did: render the whole queue.
+    "\n".join(f"{i + 1}. {track.title}" for i, track in enumerate(queue))
+
+
+def run(name: str, queue: wavelink.Queue, size: int, indexed: bool):
+    rng = random.Random(42)
+    per_entry = fill(queue, size)
+    print(f"{name} ({size} entries, {per_entry:.0f} B/entry)")
+
+    def single_move():
+        src = rng.randrange(size)
+        track = queue.peek(src)
+        queue.delete(src)
+        queue.put_at(rng.randrange(size - 1), track)
+
+    def range_move():
+        start = rng.randrange(size - 50)
+        to = rng.randrange(size - 50)
+        if indexed:
+            queue.move(start, start + 50, to)
+        else:
+            list_move(queue, start, start + 50, to)
+
+    def remove_insert():
+        pos = rng.randrange(size)
+        track = queue.peek(pos)
+        queue.delete(pos)
+        queue.put_at(pos, track)
+
+    def page():
+        start = rng.randrange(size - 10)
+        if indexed:
+            "\n".join(
+                f"{start + i + 1}. {r.title}"
+                for i, r in enumerate(queue.page(start, 10))
+            )
+        else:
+            list_page(queue, start)
+
+    timed("move 1", single_move)
+    timed("move 50 (range)", range_move)
+    timed("remove + reinsert", remove_insert)
+    timed("render queue page", page, rounds=200)
+    assert queue.count == size
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    run("wavelink.Queue", wavelink.Queue(), size, indexed=False)
+    run("IndexedQueue", bot.IndexedQueue(), size, indexed=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""Replay an event trace recorded with TRACE_PATH against bot.py.
+
+Uses the Discord and Lavalink stand-ins from load_test.py. Commands,
+button presses, autocomplete keystrokes and tracks finishing are fed back
+through the real handlers in the recorded order; track starts, skips and
+node events are what bot.py does in response, so they are compared rather
+than replayed. Hashed queries come back as stable fake ones of the same
+kind (playlist link, track link or search text), and slash commands go
+through the prefix path of the same hybrid command.
+
+--speed 1 keeps the recorded timing (2 is twice as fast); --speed 0 runs
+the events back to back, each after the previous one has finished, which
+makes two runs of the same trace do the same work in the same order;
+recorded track starts then act as sync points, so a track is playing again
+before the trace finishes it.
+
+Usage: python benchmarks/replay.py TRACE [--speed X] [--lavalink-delay S]
+       [--mirror-delay S]
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import load_test  # noqa: E402
+import wavelink  # noqa: E402
+from aiohttp import web  # noqa: E402
+from load_test import (  # noqa: E402
+    FakeGuild,
+    FakeInteraction,
+    latencies,
+    outbound,
+    percentile,
+    print_transitions,
+    rss_kb,
+    sample_loop_lag,
+)
+
+import bot  # noqa: E402
+
+# Tracks only end when the trace says they finished.
+TRACK_MS = 24 * 3600 * 1000
+START_TIMEOUT = 1.0
+QUERY_KINDS = {
+    "pl": "https://open.spotify.com/playlist/{}",
+    "url": "https://www.youtube.com/watch?v={}",
+    "q": "{}",
+}
+
+
+def untoken(arg: str) -> str:
+    kind, _, digest = arg.partition(":")
+    template = QUERY_KINDS.get(kind)
+    return template.format(digest) if template and digest else arg
+
+
+class Replay:
+    def __init__(self, lavalink: load_test.FakeLavalink):
+        self.lavalink = lavalink
+        self.guilds: dict[int, FakeGuild] = {}
+        self.members: dict[tuple[int, int], SimpleNamespace] = {}
+        self.replayed: Counter = Counter()
+        self.skipped: Counter = Counter()
+        self.recorded: Counter = Counter()
+        self.in_order = False
+        self.buttons = {
+            item.custom_id: item
+            for view in bot.control_views.values()
+            for item in view.children
+        }
+
+    def guild(self, number: int) -> FakeGuild:
+        guild = self.guilds.get(number)
+        if guild is None:
+            guild = self.guilds[number] = FakeGuild(1000 * number)
+        return guild
+
+    def member(self, guild: FakeGuild, number: int | None):
+        if number is None:
+            return guild.member
+        member = self.members.get((guild.id, number))
+        if member is None:
+            member = self.members[(guild.id, number)] = SimpleNamespace(
+                id=guild.id + 10 + number,
+                name=f"user{number}",
+                bot=False,
+                guild=guild,
+                voice=SimpleNamespace(channel=guild.voice),
+            )
+            guild.voice.members.append(member)
+        return member
+
+    async def command(self, guild: FakeGuild, user, entry: dict):
+        args = " ".join(untoken(arg) for arg in entry.get("a", []))
+        await load_test.command(guild, f"!{entry['n']} {args}".rstrip(), user)
+
+    async def button(self, guild: FakeGuild, user, entry: dict):
+        custom_id = entry["id"]
+        if custom_id in self.buttons:
+            item = self.buttons[custom_id]
+        elif custom_id and custom_id.isdigit():
+            try:
+                view = guild.text.last_view(bot.SearchView)
+            except StopIteration:
+                self.skipped["btn"] += 1
+                return
+            item = view.children[int(custom_id) - 1]
+        else:
+            self.skipped["btn"] += 1
+            return
+        await load_test.press(guild, custom_id, item, custom_id, user)
+
+    async def autocomplete(self, guild: FakeGuild, user, entry: dict):
+        current = untoken(entry["a"][0]) if entry.get("a") else ""
+        start = time.perf_counter()
+        await bot.track_autocomplete(FakeInteraction(guild, user=user), current)
+        latencies[f"~{entry['n']}"].append(time.perf_counter() - start)
+
+    async def track_started(self, guild: FakeGuild):
+        # At max speed a finished track must have been followed up before
+        # the trace ends the next one, or that end would land on nothing.
+        deadline = time.monotonic() + START_TIMEOUT
+        while time.monotonic() < deadline:
+            player = self.lavalink.players.get(guild.id)
+            if player is not None and player["track"] is not None:
+                return
+            await asyncio.sleep(0.001)
+        self.skipped["start"] += 1
+
+    async def dispatch(self, entry: dict):
+        event = entry["e"]
+        self.recorded[event] += 1
+        if "g" not in entry:
+            self.skipped[event] += 1
+            return
+        guild = self.guild(entry["g"])
+        if event == "end":
+            if entry.get("r") != "finished":
+                return
+            self.lavalink.finish(guild.id)
+        elif event == "cmd" and entry.get("n") in bot.bot.all_commands:
+            await self.command(guild, self.member(guild, entry.get("u")), entry)
+        elif event == "btn":
+            await self.button(guild, self.member(guild, entry.get("u")), entry)
+        elif event == "ac":
+            await self.autocomplete(guild, self.member(guild, entry.get("u")), entry)
+        elif event == "start":
+            if self.in_order:
+                await self.track_started(guild)
+            return
+        else:
+            self.skipped[event] += 1
+            return
+        self.replayed[event] += 1
+
+    async def safe_dispatch(self, entry: dict):
+        try:
+            await self.dispatch(entry)
+        except Exception as e:
+            self.skipped[entry["e"]] += 1
+            logging.getLogger("replay").warning(f"{entry}: {e!r}")
+
+    async def run(self, entries: list[dict], speed: float):
+        if speed <= 0:
+            self.in_order = True
+            for entry in entries:
+                await self.safe_dispatch(entry)
+            return
+        started = time.monotonic()
+        tasks = []
+        for entry in entries:
+            delay = started + entry["t"] / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.safe_dispatch(entry)))
+        await asyncio.gather(*tasks)
+
+
+def read_trace(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as trace_file:
+        entries = [json.loads(line) for line in trace_file if line.strip()]
+    return sorted((e for e in entries if "e" in e), key=lambda e: e["t"])
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("trace")
+    parser.add_argument("--speed", type=float, default=0.0)
+    parser.add_argument("--lavalink-delay", type=float, default=0.02)
+    parser.add_argument("--mirror-delay", type=float, default=0.3)
+    parser.add_argument("--settle", type=float, default=1.0)
+    args = parser.parse_args()
+    entries = read_trace(args.trace)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    lavalink = load_test.FakeLavalink(TRACK_MS, args.lavalink_delay, args.mirror_delay)
+    runner = web.AppRunner(lavalink.app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", load_test.LAVALINK_PORT).start()
+
+    client = bot.bot
+    await client._async_setup_hook()
+    client._connection.user = SimpleNamespace(id=1, name="bot", bot=True)
+    await client.setup_hook()
+    while not bot.healthy_nodes():
+        await asyncio.sleep(0.05)
+
+    replay = Replay(lavalink)
+    guilds = replay.guilds
+    client.get_guild = lambda guild_id: guilds.get(guild_id // 1000)
+    client.get_channel = lambda channel_id: next(
+        (g.voice for g in guilds.values() if g.voice.id == channel_id), None
+    )
+
+    lag: list[float] = []
+    lag_task = asyncio.create_task(sample_loop_lag(lag))
+    gc.collect()
+    rss_before = rss_kb()
+    started = time.monotonic()
+    await replay.run(entries, args.speed)
+    # Let queued panel edits, deletes and track starts land before counting.
+    await asyncio.sleep(args.settle)
+    elapsed = time.monotonic() - started
+    rss_after = rss_kb()
+    lag_task.cancel()
+
+    speed = f"{args.speed:g}x" if args.speed > 0 else "max speed"
+    recorded_for = entries[-1]["t"] if entries else 0.0
+    print(
+        f"{len(entries)} events over {recorded_for:.1f}s in {len(guilds)} guilds, "
+        f"replayed at {speed} in {elapsed:.1f}s"
+    )
+    print(f"  {'handler':<22} {'count':>6} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, values in sorted(latencies.items()):
+        print(
+            f"  {name:<22} {len(values):>6} {percentile(values, 50) * 1000:9.2f} "
+            f"{percentile(values, 99) * 1000:9.2f} {max(values) * 1000:9.2f}"
+        )
+    print(f"  events replayed {dict(replay.replayed)}, skipped {dict(replay.skipped)}")
+    print(
+        f"  tracks started {lavalink.starts} (trace {replay.recorded['start']}), "
+        f"ended {lavalink.ends} (trace {replay.recorded['end']}), "
+        f"lavalink loads {lavalink.loads}"
+    )
+    print_transitions()
+    print(f"  outbound calls {sum(outbound.values())} ({dict(outbound)})")
+    print(f"  memory {rss_after - rss_before} kB RSS")
+    print(
+        f"  loop lag p50 {percentile(lag, 50) * 1000:.2f} ms, "
+        f"p99 {percentile(lag, 99) * 1000:.2f} ms, max {max(lag, default=0) * 1000:.2f} ms"
+    )
+
+    await wavelink.Pool.close()
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,271 @@
+"""Time-to-ready and memory per guild for each CACHE_PROFILE.
+
+Each profile runs in a fresh interpreter. The child imports bot.py, runs
+setup_hook against the fake Lavalink from load_test.py, then feeds READY,
+one GUILD_CREATE per guild and some chat traffic through discord.py's own
+gateway parsers, and waits for on_ready. Guild payloads look like what
+Discord sends without the members/presences intents: channels, roles,
+emojis, the bot and whoever is in voice.
+
+Usage: python benchmarks/startup_bench.py [--guilds N] [--messages M]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+PROFILES = ("full", "lean")
+TEXT_CHANNELS = 20
+VOICE_CHANNELS = 5
+ROLES = 10
+EMOJIS = 30
+VOICE_MEMBERS = 5
+BOT_ID = 1
+TIMESTAMP = "2024-01-01T00:00:00+00:00"
+
+
+def user(user_id: int) -> dict:
+    return {
+        "id": str(user_id),
+        "username": f"user{user_id}",
+        "discriminator": "0",
+        "avatar": None,
+        "global_name": None,
+    }
+
+
+def member(user_id: int) -> dict:
+    return {
+        "user": user(user_id),
+        "roles": [],
+        "joined_at": TIMESTAMP,
+        "deaf": False,
+        "mute": False,
+        "flags": 0,
+    }
+
+
+def guild_payload(guild_id: int) -> dict:
+    text = [
+        {
+            "id": str(guild_id + 100 + i),
+            "type": 0,
+            "name": f"text-{i}",
+            "position": i,
+            "permission_overwrites": [],
+        }
+        for i in range(TEXT_CHANNELS)
+    ]
+    voice = [
+        {
+            "id": str(guild_id + 200 + i),
+            "type": 2,
+            "name": f"voice-{i}",
+            "position": i,
+            "permission_overwrites": [],
+            "bitrate": 64000,
+            "user_limit": 0,
+            "rtc_region": None,
+        }
+        for i in range(VOICE_CHANNELS)
+    ]
+    listeners = [guild_id + 500 + i for i in range(VOICE_MEMBERS)]
+    return {
+        "id": str(guild_id),
+        "name": f"guild {guild_id}",
+        "owner_id": str(guild_id + 1),
+        "member_count": 5000,
+        "large": True,
+        "features": [],
+        "icon": None,
+        "roles": [
+            {
+                "id": str(guild_id + (300 + i if i else 0)),
+                "name": f"role-{i}",
+                "color": 0,
+                "hoist": False,
+                "position": i,
+                "permissions": "0",
+                "managed": False,
+                "mentionable": False,
+            }
+            for i in range(ROLES)
+        ],
+        "emojis": [
+            {
+                "id": str(guild_id + 400 + i),
+                "name": f"emoji{i}",
+                "roles": [],
+                "require_colons": True,
+                "managed": False,
+                "animated": False,
+                "available": True,
+            }
+            for i in range(EMOJIS)
+        ],
+        "stickers": [],
+        "channels": text + voice,
+        "threads": [],
+        "members": [member(BOT_ID)] + [member(i) for i in listeners],
+        "voice_states": [
+            {
+                "channel_id": voice[0]["id"],
+                "user_id": str(user_id),
+                "session_id": "x",
+                "deaf": False,
+                "mute": False,
+                "self_deaf": False,
+                "self_mute": False,
+                "self_video": False,
+                "suppress": False,
+                "request_to_speak_timestamp": None,
+            }
+            for user_id in listeners
+        ],
+        "presences": [],
+        "stage_instances": [],
+        "guild_scheduled_events": [],
+    }
+
+
+def message_payload(guild_id: int, message_id: int) -> dict:
+    author = guild_id + 500
+    return {
+        "id": str(message_id),
+        "channel_id": str(guild_id + 100),
+        "guild_id": str(guild_id),
+        "author": user(author),
+        "member": {k: v for k, v in member(author).items() if k != "user"},
+        "content": "hello there",
+        "timestamp": TIMESTAMP,
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+    }
+
+
+async def child(guilds: int, messages: int, spawned: float) -> dict:
+    import asyncio
+    import gc
+    import logging
+    from types import SimpleNamespace
+
+    started = time.perf_counter()
+    import load_test
+    import wavelink
+    from aiohttp import web
+
+    import bot
+
+    imported = time.perf_counter()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    lavalink = load_test.FakeLavalink(2000, 0.0)
+    runner = web.AppRunner(lavalink.app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", load_test.LAVALINK_PORT).start()
+
+    client = bot.bot
+    await client._async_setup_hook()
+    # wavelink identifies with the bot's user id, which READY would set.
+    client._connection.user = SimpleNamespace(id=BOT_ID)
+    await client.setup_hook()
+    while not bot.healthy_nodes():
+        await asyncio.sleep(0.01)
+    gc.collect()
+    rss_base = load_test.rss_kb()
+    setup_done = time.perf_counter()
+
+    state = client._connection
+    state.guild_ready_timeout = 0.05
+    ids = [(i + 1) << 32 for i in range(guilds)]
+    state.parsers["READY"](
+        {
+            "v": 10,
+            "user": {**user(BOT_ID), "bot": True},
+            "guilds": [{"id": str(g), "unavailable": True} for g in ids],
+            "session_id": "bench",
+            "resume_gateway_url": "wss://localhost",
+            "application": {"id": str(BOT_ID), "flags": 0},
+        }
+    )
+    for guild_id in ids:
+        state.parsers["GUILD_CREATE"](guild_payload(guild_id))
+    await client.wait_until_ready()
+    ready = time.perf_counter()
+    time_to_ready = time.time() - spawned
+
+    message_id = 1 << 40
+    for _ in range(messages):
+        for guild_id in ids:
+            message_id += 1
+            state.parsers["MESSAGE_CREATE"](message_payload(guild_id, message_id))
+    await asyncio.sleep(0.1)
+    gc.collect()
+    rss = load_test.rss_kb()
+
+    await wavelink.Pool.close()
+    await runner.cleanup()
+    return {
+        "ready_s": time_to_ready,
+        "import_s": imported - started,
+        "setup_s": setup_done - imported,
+        "guilds_s": ready - setup_done,
+        "rss_kb": rss,
+        "per_guild_kb": (rss - rss_base) / guilds,
+        "cached_messages": len(client.cached_messages),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--child", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        import asyncio
+
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        print(json.dumps(asyncio.run(child(args.guilds, args.messages, args.child))))
+        return
+
+    print(f"{args.guilds} guilds, {args.messages} messages per guild")
+    print(
+        f"  {'profile':<8} {'ready s':>8} {'import s':>9} {'guilds s':>9} "
+        f"{'RSS MB':>8} {'kB/guild':>9} {'messages':>9}"
+    )
+    for profile in PROFILES:
+        result = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                f"--child={time.time()}",
+                f"--guilds={args.guilds}",
+                f"--messages={args.messages}",
+            ],
+            env=dict(os.environ, CACHE_PROFILE=profile),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        print(
+            f"  {profile:<8} {stats['ready_s']:8.2f} {stats['import_s']:9.2f} "
+            f"{stats['guilds_s']:9.2f} {stats['rss_kb'] / 1024:8.1f} "
+            f"{stats['per_guild_kb']:9.1f} {stats['cached_messages']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
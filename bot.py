@@ -1,240 +1,3213 @@
 import asyncio
+import atexit
+import contextlib
+import contextvars
+import copy
+import hashlib
+import heapq
+import json
 import logging
+import logging.handlers
+import math
 import os
-from typing import cast
+import queue
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from collections.abc import MutableSequence
+from typing import TYPE_CHECKING, cast
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 import aiohttp
 import discord
 import wavelink
 from aiohttp import web
+from discord import app_commands
 from discord.ext import commands
 from discord.ui import Button, View
 from dotenv import load_dotenv
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+from logformat import stream_handler
+
+if TYPE_CHECKING:
+    import numpy as np
+
+load_dotenv()
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Each call site may log LOG_SAMPLE_BURST records per LOG_SAMPLE_WINDOW
+# seconds; the rest are counted and reported on its next record.
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", 20))
+LOG_SAMPLE_WINDOW = float(os.getenv("LOG_SAMPLE_WINDOW", 60))
+
+log_fields: contextvars.ContextVar[dict] = contextvars.ContextVar(
+    "log_fields", default={}
+)
+
+
+def log_context(**fields):
+    """Attach guild/command/track fields to every record the current task logs."""
+    log_fields.set({**log_fields.get(), **fields})
+
+
+class LogSampler(logging.Filter):
+    def __init__(self, burst: int, window: float):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        # (path, line) -> [window start, records in window, suppressed]
+        self._sites: dict[tuple[str, int], list] = {}
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Warnings and errors are never sampled away.
+        if record.levelno >= logging.WARNING:
+            return True
+        site = self._sites.get((record.pathname, record.lineno))
+        if site is None:
+            site = self._sites[(record.pathname, record.lineno)] = [0.0, 0, 0]
+        if record.created - site[0] >= self.window:
+            site[0], site[1] = record.created, 0
+        if site[1] >= self.burst:
+            site[2] += 1
+            self.suppressed += 1
+            return False
+        site[1] += 1
+        if site[2]:
+            record.suppressed, site[2] = site[2], 0
+        return True
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread without ever blocking the loop.
+
+    Only the message and the task's log fields are resolved here;
+    formatting (including tracebacks) happens on the writer thread. When
+    the queue is full the record is dropped and counted.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        record.fields = log_fields.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(sampler: LogSampler) -> LogQueueHandler:
+    stream = stream_handler(LOG_FORMAT)
+    handler = LogQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(sampler)
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(logging.INFO)
+    listener = logging.handlers.QueueListener(handler.queue, stream)
+    listener.start()
+    atexit.register(listener.stop)
+    return handler
+
+
+log_sampler = LogSampler(LOG_SAMPLE_BURST, LOG_SAMPLE_WINDOW)
+log_handler = setup_logging(log_sampler)
+logger = logging.getLogger(__name__)
+
+DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
+LAVALINK_URI = os.getenv("LAVALINK_URI", "http://localhost:2333")
+LAVALINK_PASSWORD = os.getenv("LAVALINK_PASSWORD", "youshallnotpass")
+# Comma separated "uri" or "uri|password" entries; falls back to LAVALINK_URI.
+LAVALINK_NODES = os.getenv("LAVALINK_NODES", "")
+NODE_STATS_INTERVAL = int(os.getenv("NODE_STATS_INTERVAL", 30))
+# Admission control: a node counts as full once any of these is reached.
+ADMIT_MAX_PLAYERS = int(os.getenv("ADMIT_MAX_PLAYERS", 100))
+ADMIT_MAX_CPU = float(os.getenv("ADMIT_MAX_CPU", 0.85))
+ADMIT_MAX_FRAME_LOSS = int(os.getenv("ADMIT_MAX_FRAME_LOSS", 300))
+ADMIT_MAX_MEMORY = float(os.getenv("ADMIT_MAX_MEMORY", 0.9))
+ADMIT_BUSY_RATIO = float(os.getenv("ADMIT_BUSY_RATIO", 0.75))
+ADMIT_QUEUE_TIMEOUT = float(os.getenv("ADMIT_QUEUE_TIMEOUT", 30))
+BUSY_INGEST_LIMIT = int(os.getenv("BUSY_INGEST_LIMIT", 2))
+# Token buckets per user and per guild, for each command class: burst size
+# and refill per second. Playlist loads and searches cost more than a click.
+THROTTLE_USER_BURST = float(os.getenv("THROTTLE_USER_BURST", 10))
+THROTTLE_USER_RATE = float(os.getenv("THROTTLE_USER_RATE", 0.5))
+THROTTLE_GUILD_BURST = float(os.getenv("THROTTLE_GUILD_BURST", 40))
+THROTTLE_GUILD_RATE = float(os.getenv("THROTTLE_GUILD_RATE", 2))
+THROTTLE_MAX_KEYS = int(os.getenv("THROTTLE_MAX_KEYS", 100000))
+# Set by cluster.py when the bot runs as one worker of a sharded cluster.
+CLUSTER_ID = int(os.getenv("CLUSTER_ID", 0))
+SHARD_COUNT = os.getenv("SHARD_COUNT")
+SHARD_IDS = os.getenv("SHARD_IDS")
+# Slash commands are global, so one worker syncing them is enough. They are
+# only pushed when their payloads differ from the last sync ("force" always
+# syncs), so restart loops stay clear of Discord's command rate limit.
+SYNC_COMMANDS = os.getenv("SYNC_COMMANDS", "1") if CLUSTER_ID == 0 else "0"
+COMMAND_HASH_PATH = os.getenv("COMMAND_HASH_PATH", "command_sync.hash")
+
+# "lean" keeps only what the music commands read: guild, voice state and
+# guild message events, no message cache and members only while in voice.
+# "full" is discord.py's defaults.
+CACHE_PROFILE = os.getenv("CACHE_PROFILE", "lean")
+
+if CACHE_PROFILE == "full":
+    intents = discord.Intents.default()
+    client_options = {}
+else:
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    member_cache = discord.MemberCacheFlags.none()
+    member_cache.voice = True
+    client_options = {
+        "max_messages": None,
+        "member_cache_flags": member_cache,
+        "chunk_guilds_at_startup": False,
+    }
+intents.voice_states = True
+intents.message_content = True
+
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(
+        command_prefix="!",
+        intents=intents,
+        shard_count=int(SHARD_COUNT),
+        shard_ids=[int(i) for i in SHARD_IDS.split(",")] if SHARD_IDS else None,
+        **client_options,
+    )
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents, **client_options)
+bot.remove_command("help")
+
+STANDBY_TIMEOUT = 900
+PANEL_DEBOUNCE = float(os.getenv("PANEL_DEBOUNCE", 1.5))
+# Per-channel outbound scheduling: Discord's message bucket as we estimate
+# it, how many ops may wait per channel, and how long deletions are held
+# so they can go out as one bulk delete.
+OUTBOUND_RATE = int(os.getenv("OUTBOUND_RATE", 5))
+OUTBOUND_PER = float(os.getenv("OUTBOUND_PER", 5))
+OUTBOUND_MAX_DEPTH = int(os.getenv("OUTBOUND_MAX_DEPTH", 20))
+OUTBOUND_DELETE_WINDOW = float(os.getenv("OUTBOUND_DELETE_WINDOW", 1))
+PLAYER_UPDATE_WINDOW = float(os.getenv("PLAYER_UPDATE_WINDOW", 0.3))
+PLAYLIST_FIRST_BATCH = int(os.getenv("PLAYLIST_FIRST_BATCH", 10))
+PLAYLIST_BATCH = int(os.getenv("PLAYLIST_BATCH", 50))
+PLAYLIST_PROGRESS_INTERVAL = 3
+PREFETCH_DEPTH = int(os.getenv("PREFETCH_DEPTH", 2))
+# Sources LavaSrc plays through a YouTube mirror lookup at track start.
+MIRRORED_SOURCES = {"spotify", "applemusic", "deezer"}
+GUILD_STATE_IDLE_TTL = int(os.getenv("GUILD_STATE_IDLE_TTL", 1800))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.5))
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", 0.25))
+# /debug/profile is only served when this is set and passed as ?token=.
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")
+MAX_PROFILE_SECONDS = 60
+transition_stats = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0}
+node_stats: dict[str, wavelink.StatsResponsePayload] = {}
+
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 512))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 6 * 60 * 60))
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", "search_cache.db")
+# The disk tier is purged of expired rows and trimmed to this many, oldest
+# first, on open and then every SEARCH_CACHE_PURGE_EVERY writes.
+SEARCH_CACHE_MAX_ROWS = int(os.getenv("SEARCH_CACHE_MAX_ROWS", 50000))
+SEARCH_CACHE_PURGE_EVERY = int(os.getenv("SEARCH_CACHE_PURGE_EVERY", 200))
+STATE_PATH = os.getenv("STATE_PATH", "guild_state.db")
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", 5))
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", 15))
+COMMAND_TIMEOUT = float(os.getenv("COMMAND_TIMEOUT", 20))
+MAX_LOOKUPS = int(os.getenv("MAX_LOOKUPS", 16))
+TRACK_INDEX_SIZE = int(os.getenv("TRACK_INDEX_SIZE", 2000))
+GUILD_TRACK_INDEX_SIZE = int(os.getenv("GUILD_TRACK_INDEX_SIZE", 200))
+AUTOCOMPLETE_TIMEOUT = 2.0
+# A user's search fallback only runs once they stop typing for this long.
+AUTOCOMPLETE_DEBOUNCE = float(os.getenv("AUTOCOMPLETE_DEBOUNCE", 0.35))
+# Opt-in event trace for benchmarks/replay.py; nothing is recorded unless set.
+TRACE_PATH = os.getenv("TRACE_PATH")
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", 1))
+# Autoplay: tracks remembered per guild, and how many guilds keep a model.
+RECOMMENDER_SIZE = int(os.getenv("RECOMMENDER_SIZE", 256))
+RECOMMENDER_GUILDS = int(os.getenv("RECOMMENDER_GUILDS", 64))
+# Recent plays kept for every guild (up to RECOMMENDER_HISTORY_GUILDS of
+# them); a full history or turning autoplay on builds the model from it.
+RECOMMENDER_HISTORY = int(os.getenv("RECOMMENDER_HISTORY", 64))
+RECOMMENDER_HISTORY_GUILDS = int(os.getenv("RECOMMENDER_HISTORY_GUILDS", 2048))
+
+
+def get_player(ctx_or_interaction) -> wavelink.Player | None:
+    if isinstance(ctx_or_interaction, commands.Context):
+        guild = ctx_or_interaction.guild
+    else:
+        guild = ctx_or_interaction.guild
+    if guild and guild.voice_client:
+        return cast(wavelink.Player, guild.voice_client)
+    return None
+
+
+def format_duration(ms: int) -> str:
+    seconds = ms // 1000
+    minutes = seconds // 60
+    seconds = seconds % 60
+    return f"{minutes}:{seconds:02d}"
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram:
+    """Prometheus histogram with label children bound ahead of the hot path.
+
+    Call labels() once at start-up and keep the child; observe() on a child
+    is a bisect and three in-place updates.
+    """
+
+    def __init__(
+        self, name: str, help_text: str, labelnames=(), buckets=LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._children: dict[tuple, HistogramChild] = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values) -> HistogramChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = HistogramChild(self.buckets)
+        return child
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def render(self, out: list[str]):
+        out.append(f"# HELP {self.name} {self.help_text}")
+        out.append(f"# TYPE {self.name} histogram")
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), child.counts):
+                cumulative += count
+                labels = _labels(self.labelnames, values, f'le="{bound}"')
+                out.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.labelnames, values)
+            out.append(f"{self.name}_sum{labels} {child.sum}")
+            out.append(f"{self.name}_count{labels} {child.count}")
+
+
+def render_gauge(
+    out: list[str], name: str, help_text: str, labelnames, samples, kind="gauge"
+):
+    out.append(f"# HELP {name} {help_text}")
+    out.append(f"# TYPE {name} {kind}")
+    for values, value in samples:
+        out.append(f"{name}{_labels(tuple(labelnames), values)} {value}")
+
+
+command_latency = Histogram(
+    "bot_command_latency_seconds", "Prefix command handling time.", ("command",)
+)
+search_latency = Histogram(
+    "bot_search_latency_seconds", "Track search time by outcome.", ("outcome",)
+)
+SEARCH_MEMORY_HIT = search_latency.labels("memory_hit")
+SEARCH_DISK_HIT = search_latency.labels("disk_hit")
+SEARCH_SHARED = search_latency.labels("shared")
+SEARCH_MISS = search_latency.labels("miss")
+SEARCH_EMPTY = search_latency.labels("empty")
+SEARCH_ERROR = search_latency.labels("error")
+AUTOCOMPLETE_LATENCY = command_latency.labels("autocomplete")
+transition_gap = Histogram(
+    "bot_track_transition_seconds", "Gap between a track ending and the next starting."
+)
+rest_latency = Histogram(
+    "bot_discord_rest_latency_seconds",
+    "Discord REST request time.",
+    ("method", "route"),
+)
+loop_lag = Histogram(
+    "bot_event_loop_lag_seconds",
+    "How late the loop monitor woke up.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+command_metrics: dict[str, HistogramChild] = {}
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{os.path.basename(code.co_filename)}:{name}"
+
+
+def thread_stack(thread_id: int) -> list[str]:
+    frame = sys._current_frames().get(thread_id)
+    stack = []
+    while frame is not None:
+        stack.append(frame_name(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class LoopMonitor:
+    """Measures event loop lag and reports callbacks that block it.
+
+    A coroutine wakes every LOOP_LAG_INTERVAL seconds and records how late
+    it woke. A watchdog thread checks the coroutine's heartbeat; if the loop
+    has not ticked for LOOP_STALL_THRESHOLD it logs the loop thread's
+    current stack, which names the handler that is holding it.
+    """
+
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.heartbeat = time.monotonic()
+        self.thread_id: int | None = None
+        self.stalls = 0
+        self.max_lag = 0.0
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+        asyncio.create_task(self._measure())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    async def _measure(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.heartbeat = now
+            lag = max(0.0, now - expected)
+            self.max_lag = max(self.max_lag, lag)
+            loop_lag.observe(lag)
+
+    def _watch(self):
+        reported = False
+        while True:
+            time.sleep(self.threshold / 2)
+            stalled = time.monotonic() - self.heartbeat - self.interval
+            if stalled < self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            self.stalls += 1
+            stack = thread_stack(self.thread_id)
+            logger.warning(
+                f"Event loop blocked for {stalled:.2f}s in {stack[-1] if stack else '?'}; "
+                f"stack: {' <- '.join(reversed(stack[-8:]))}"
+            )
+
+
+def sample_profile(thread_id: int, seconds: float, interval: float = 0.005) -> str:
+    """Sample a thread's stack and return it in collapsed-stack format."""
+    counts: dict[str, int] = {}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        stack = ";".join(thread_stack(thread_id))
+        if stack:
+            counts[stack] = counts.get(stack, 0) + 1
+        time.sleep(interval)
+    return "\n".join(f"{stack} {count}" for stack, count in counts.items()) + "\n"
+
+
+loop_monitor = LoopMonitor(LOOP_LAG_INTERVAL, LOOP_STALL_THRESHOLD)
+
+
+class GuildTurn:
+    """One command's place in its guild's serialized order of state changes.
+
+    Turns are handed out when a command arrives, so lookups can run side by
+    side while connect/enqueue/play still happen one at a time and in order.
+    """
+
+    __slots__ = ("previous", "done")
+
+    def __init__(self, previous: asyncio.Future | None):
+        self.previous = previous
+        self.done = asyncio.get_running_loop().create_future()
+
+    async def wait(self):
+        if self.previous is None or self.previous.done():
+            return
+        try:
+            await asyncio.shield(self.previous)
+        except asyncio.CancelledError:
+            self.release()
+            raise
+
+    def release(self):
+        if self.previous is None or self.previous.done():
+            self._finish()
+        else:
+            # Gave up before our turn came; the next one still has to wait
+            # for everything queued ahead of us.
+            self.previous.add_done_callback(lambda _: self._finish())
+
+    def _finish(self):
+        if not self.done.done():
+            self.done.set_result(None)
+
+    async def __aenter__(self):
+        await self.wait()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class GuildState:
+    __slots__ = (
+        "guild_id",
+        "home",
+        "panel",
+        "panel_update",
+        "looping",
+        "shuffled",
+        "ingest_task",
+        "prefetch_task",
+        "track_ended_at",
+        "last_active",
+        "last_turn",
+        "pending_playnow",
+        "track_index",
+        "pending_update",
+        "update_flush",
+        "filter_preset",
+        "autoplay",
+        "autoplay_next",
+        "autoplay_task",
+    )
+
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        self.home: discord.abc.Messageable | None = None
+        self.panel: discord.Message | None = None
+        self.panel_update: asyncio.TimerHandle | None = None
+        self.looping = False
+        self.shuffled = False
+        self.ingest_task: asyncio.Task | None = None
+        self.prefetch_task: asyncio.Task | None = None
+        self.track_ended_at: float | None = None
+        self.last_active = time.monotonic()
+        self.last_turn: asyncio.Future | None = None
+        self.pending_playnow: asyncio.Task | None = None
+        self.track_index: TrackIndex | None = None
+        self.pending_update: dict = {}
+        self.update_flush: asyncio.TimerHandle | None = None
+        self.filter_preset = "off"
+        self.autoplay = False
+        self.autoplay_next: wavelink.Playable | None = None
+        self.autoplay_task: asyncio.Task | None = None
+
+    def reserve_turn(self) -> GuildTurn:
+        turn = GuildTurn(self.last_turn)
+        self.last_turn = turn.done
+        return turn
+
+    def close(self):
+        for handle in (self.panel_update, self.update_flush):
+            if handle is not None:
+                handle.cancel()
+        for task in (
+            self.ingest_task,
+            self.prefetch_task,
+            self.pending_playnow,
+            self.autoplay_task,
+        ):
+            if task is not None and not task.done():
+                task.cancel()
+
+
+class GuildRegistry:
+    """Owns every guild's GuildState.
+
+    States are created on first use and evicted when the bot leaves voice,
+    leaves the guild, or the state has sat unused for GUILD_STATE_IDLE_TTL.
+    """
+
+    def __init__(self, idle_ttl: int):
+        self.idle_ttl = idle_ttl
+        self._states: dict[int, GuildState] = {}
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def get(self, guild_id: int) -> GuildState:
+        state = self._states.get(guild_id)
+        if state is None:
+            state = self._states[guild_id] = GuildState(guild_id)
+        state.last_active = time.monotonic()
+        return state
+
+    def peek(self, guild_id: int) -> GuildState | None:
+        return self._states.get(guild_id)
+
+    def evict(self, guild_id: int):
+        state = self._states.pop(guild_id, None)
+        if state is not None:
+            state.close()
+            self.evictions += 1
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        for guild_id, state in list(self._states.items()):
+            guild = bot.get_guild(guild_id)
+            if state.last_active < cutoff and not (guild and guild.voice_client):
+                self.evict(guild_id)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(60)
+            self.evict_idle()
+
+    def stats(self) -> dict[str, int]:
+        size = sys.getsizeof(self._states) + sum(
+            sys.getsizeof(state) for state in self._states.values()
+        )
+        return {"guilds": len(self._states), "bytes": size, "evictions": self.evictions}
+
+
+guild_states = GuildRegistry(GUILD_STATE_IDLE_TTL)
+
+
+class TrackRecord:
+    """Compact queue entry; rebuilt into a Playable only when read."""
+
+    __slots__ = (
+        "encoded",
+        "identifier",
+        "title",
+        "author",
+        "length",
+        "uri",
+        "artwork",
+        "isrc",
+        "source",
+        "is_stream",
+        "is_seekable",
+    )
+
+    def __init__(self, track: wavelink.Playable):
+        self.encoded = track.encoded
+        self.identifier = track.identifier
+        self.title = track.title
+        self.author = track.author
+        self.length = track.length
+        self.uri = track.uri
+        self.artwork = track.artwork
+        self.isrc = track.isrc
+        self.source = track.source
+        self.is_stream = track.is_stream
+        self.is_seekable = track.is_seekable
+
+    def dump(self) -> list:
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def load(cls, values: list) -> "TrackRecord":
+        record = object.__new__(cls)
+        for name, value in zip(cls.__slots__, values):
+            setattr(record, name, value)
+        return record
+
+    def to_playable(self) -> wavelink.Playable:
+        return wavelink.Playable(
+            {
+                "encoded": self.encoded,
+                "info": {
+                    "identifier": self.identifier,
+                    "isSeekable": self.is_seekable,
+                    "author": self.author,
+                    "length": self.length,
+                    "isStream": self.is_stream,
+                    "position": 0,
+                    "title": self.title,
+                    "uri": self.uri,
+                    "artworkUrl": self.artwork,
+                    "isrc": self.isrc,
+                    "sourceName": self.source,
+                },
+                "pluginInfo": {},
+            }
+        )
+
+
+def to_record(track: "wavelink.Playable | TrackRecord") -> TrackRecord:
+    return track if isinstance(track, TrackRecord) else TrackRecord(track)
+
+
+class TrackList(MutableSequence):
+    """List of tracks stored as chunks of TrackRecords.
+
+    Chunk sizes are kept in a Fenwick tree, so finding a position and
+    growing or shrinking a chunk are O(log n); only adding or dropping
+    whole chunks rebuilds the tree, at most once per CHUNK_SIZE edits. Each
+    record also maps to the chunk holding it, so the shuffle view can find a
+    record without scanning. It is a drop-in for the list wavelink.Queue
+    keeps in ``_items``.
+    """
+
+    CHUNK_SIZE = 256
+
+    def __init__(self, tracks=()):
+        self._chunks: list[list[TrackRecord]] = []
+        self._tree: list[int] = [0]
+        self._position: dict[int, int] = {}
+        self._owner: dict[int, list[TrackRecord]] = {}
+        self._dirty = False
+        self._len = 0
+        self.extend(tracks)
+
+    def _reindex(self):
+        tree = [0]
+        tree.extend(len(chunk) for chunk in self._chunks)
+        size = len(tree)
+        for i in range(1, size):
+            parent = i + (i & -i)
+            if parent < size:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._position = {id(chunk): i for i, chunk in enumerate(self._chunks)}
+        self._dirty = False
+
+    def _prefix(self, chunk: int) -> int:
+        # Items in chunks [0, chunk).
+        total = 0
+        while chunk:
+            total += self._tree[chunk]
+            chunk &= chunk - 1
+        return total
+
+    def _resized(self, chunk: int, delta: int):
+        self._len += delta
+        if self._dirty:
+            return
+        tree = self._tree
+        i = chunk + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _restructured(self, delta: int):
+        self._len += delta
+        self._dirty = True
+
+    def _append_chunk(self, items: list[TrackRecord]):
+        self._chunks.append(items)
+        self._own(items)
+        self._len += len(items)
+        if self._dirty:
+            return
+        i = len(self._chunks)
+        low = i & -i
+        self._tree.append(self._prefix(i - 1) - self._prefix(i - low) + len(items))
+        self._position[id(items)] = i - 1
+
+    def _own(self, items: list[TrackRecord], records=None):
+        owner = self._owner
+        for record in items if records is None else records:
+            owner[id(record)] = items
+
+    def _disown(self, records: list[TrackRecord]):
+        owner = self._owner
+        for record in records:
+            owner.pop(id(record), None)
+
+    def _locate(self, index: int) -> tuple[int, int]:
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("queue index out of range")
+        if self._dirty:
+            self._reindex()
+        tree = self._tree
+        size = len(tree)
+        chunk = 0
+        step = 1 << (size.bit_length() - 1)
+        while step:
+            nxt = chunk + step
+            if nxt < size and tree[nxt] <= index:
+                chunk = nxt
+                index -= tree[nxt]
+            step >>= 1
+        return chunk, index
+
+    def _rechunk(self, chunk: int):
+        items = self._chunks[chunk]
+        if len(items) <= self.CHUNK_SIZE * 2:
+            return
+        size = self.CHUNK_SIZE
+        pieces = [items[i : i + size] for i in range(0, len(items), size)]
+        self._chunks[chunk : chunk + 1] = pieces
+        for piece in pieces:
+            self._own(piece)
+        self._dirty = True
+
+    def _drop_empty(self, chunk: int):
+        if not self._chunks[chunk]:
+            del self._chunks[chunk]
+            self._dirty = True
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            for record in chunk:
+                yield record.to_playable()
+
+    def __reversed__(self):
+        for chunk in reversed(self._chunks):
+            for record in reversed(chunk):
+                yield record.to_playable()
+
+    def __contains__(self, track) -> bool:
+        try:
+            self.index(track)
+        except ValueError:
+            return False
+        return True
+
+    def records(self, start: int = 0, stop: int | None = None) -> list[TrackRecord]:
+        start, stop, _ = slice(start, stop).indices(self._len)
+        if start >= stop:
+            return []
+        chunk, offset = self._locate(start)
+        out: list[TrackRecord] = []
+        while len(out) < stop - start:
+            out.extend(self._chunks[chunk][offset : offset + stop - start - len(out)])
+            chunk += 1
+            offset = 0
+        return out
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step == 1:
+                return [record.to_playable() for record in self.records(start, stop)]
+            return [self[i] for i in range(start, stop, step)]
+        chunk, offset = self._locate(index)
+        return self._chunks[chunk][offset].to_playable()
+
+    def __setitem__(self, index, track):
+        if isinstance(index, slice):
+            raise TypeError("slice assignment is not supported")
+        chunk, offset = self._locate(index)
+        self._replace(chunk, offset, to_record(track))
+
+    def _replace(self, chunk: int, offset: int, record: TrackRecord):
+        items = self._chunks[chunk]
+        self._owner.pop(id(items[offset]), None)
+        items[offset] = record
+        self._owner[id(record)] = items
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                for i in sorted(range(start, stop, step), reverse=True):
+                    del self[i]
+                return
+            self.delete_range(start, stop)
+            return
+        chunk, offset = self._locate(index)
+        self._delete_at(chunk, offset)
+
+    def _delete_at(self, chunk: int, offset: int):
+        self._owner.pop(id(self._chunks[chunk].pop(offset)), None)
+        self._resized(chunk, -1)
+        self._drop_empty(chunk)
+
+    def delete_range(self, start: int, stop: int, disown: bool = True):
+        start, stop, _ = slice(start, stop).indices(self._len)
+        remaining = stop - start
+        if remaining <= 0:
+            return
+        chunk, offset = self._locate(start)
+        while remaining:
+            items = self._chunks[chunk]
+            taken = min(remaining, len(items) - offset)
+            if disown:
+                self._disown(items[offset : offset + taken])
+            del items[offset : offset + taken]
+            self._resized(chunk, -taken)
+            remaining -= taken
+            if items:
+                chunk += 1
+            else:
+                self._drop_empty(chunk)
+            offset = 0
+
+    def insert(self, index: int, track):
+        self.insert_many(index, [to_record(track)])
+
+    def insert_many(self, index: int, records: list[TrackRecord]):
+        if not records:
+            return
+        if index < 0:
+            index = max(0, index + self._len)
+        if index >= self._len:
+            if self._chunks and len(self._chunks[-1]) < self.CHUNK_SIZE:
+                last = self._chunks[-1]
+                room = records[: self.CHUNK_SIZE - len(last)]
+                last.extend(room)
+                self._own(last, room)
+                self._resized(len(self._chunks) - 1, len(room))
+                records = records[len(room) :]
+            for i in range(0, len(records), self.CHUNK_SIZE):
+                self._append_chunk(records[i : i + self.CHUNK_SIZE])
+            return
+        chunk, offset = self._locate(index)
+        items = self._chunks[chunk]
+        items[offset:offset] = records
+        self._own(items, records)
+        self._resized(chunk, len(records))
+        self._rechunk(chunk)
+
+    def extend(self, tracks):
+        self.insert_many(self._len, [to_record(track) for track in tracks])
+
+    def append(self, track):
+        self.insert_many(self._len, [to_record(track)])
+
+    def index(self, track, start: int = 0, stop: int | None = None) -> int:
+        encoded = track.encoded
+        position = 0
+        for chunk in self._chunks:
+            for record in chunk:
+                if record.encoded == encoded and record.identifier == track.identifier:
+                    if position >= start and (stop is None or position < stop):
+                        return position
+                position += 1
+        raise ValueError(f"{track!r} is not in queue")
+
+    def move(self, start: int, stop: int, to: int):
+        moved = self.records(start, stop)
+        # Reinserting points the moved records at their new chunk anyway.
+        self.delete_range(start, stop, disown=False)
+        self.insert_many(min(to, self._len), moved)
+
+    def record_at(self, index: int) -> TrackRecord:
+        chunk, offset = self._locate(index)
+        return self._chunks[chunk][offset]
+
+    def _find(self, record: TrackRecord) -> tuple[int, int]:
+        items = self._owner.get(id(record))
+        if items is None:
+            raise ValueError("record is not in queue")
+        if self._dirty:
+            self._reindex()
+        # TrackRecord has no __eq__, so list.index matches by identity.
+        return self._position[id(items)], items.index(record)
+
+    def replace_record(self, old: TrackRecord, new: TrackRecord):
+        chunk, offset = self._find(old)
+        self._replace(chunk, offset, new)
+
+    def remove_records(self, records: list[TrackRecord]):
+        if len(records) == 1:
+            self._delete_at(*self._find(records[0]))
+            return
+        ids = {id(record) for record in records}
+        chunks = [
+            [record for record in items if id(record) not in ids]
+            for items in self._chunks
+        ]
+        self._chunks = [items for items in chunks if items]
+        self._owner = {}
+        for items in self._chunks:
+            self._own(items)
+        self._restructured(sum(map(len, self._chunks)) - self._len)
+
+    def shuffle(self):
+        records = self.records()
+        random.shuffle(records)
+        self.clear()
+        self.insert_many(0, records)
+
+    def clear(self):
+        self._chunks = []
+        self._tree = [0]
+        self._position = {}
+        self._owner = {}
+        self._dirty = False
+        self._len = 0
+
+    def copy(self) -> "TrackList":
+        copied = TrackList()
+        copied.insert_many(0, self.records())
+        return copied
+
+
+class ShuffledTrackList(MutableSequence):
+    """Play-order view of a TrackList in shuffle mode.
+
+    The wrapped list keeps the original order and every track that is still
+    queued. The play order is drawn lazily: only the prefix that something
+    has looked at (the next track, a queue page, prefetch) is fixed, and
+    undrawn tracks, including ones added later, stay in the pool for the
+    next draw. Indices and edits use the play order; turning shuffle off
+    just unwraps the original list.
+    """
+
+    def __init__(self, original: TrackList):
+        self.original = original
+        self._order: list[TrackRecord] = []
+        self._drawn: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.original)
+
+    def _draw(self, count: int):
+        size = len(self.original)
+        needed = min(count - len(self._order), size - len(self._drawn))
+        if needed <= 0:
+            return
+        # Past half the pool, one pass over the undrawn tracks beats retrying.
+        if (len(self._drawn) + needed) * 2 > size:
+            undrawn = [
+                record
+                for record in self.original.records()
+                if id(record) not in self._drawn
+            ]
+            picks = random.sample(undrawn, needed)
+            self._drawn.update(id(record) for record in picks)
+        else:
+            # Rejection sampling: each try hits an undrawn track more often than not.
+            picks = []
+            while len(picks) < needed:
+                record = self.original.record_at(random.randrange(size))
+                if id(record) not in self._drawn:
+                    self._drawn.add(id(record))
+                    picks.append(record)
+        self._order.extend(picks)
+
+    def _index(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("queue index out of range")
+        self._draw(index + 1)
+        return index
+
+    def _forget(self, records: list[TrackRecord]):
+        for record in records:
+            self._drawn.discard(id(record))
+        self.original.remove_records(records)
+
+    def records(self, start: int = 0, stop: int | None = None) -> list[TrackRecord]:
+        start, stop, _ = slice(start, stop).indices(len(self))
+        self._draw(stop)
+        return self._order[start:stop]
+
+    def record_at(self, index: int) -> TrackRecord:
+        return self._order[self._index(index)]
+
+    def __iter__(self):
+        for record in self.records():
+            yield record.to_playable()
+
+    def __contains__(self, track) -> bool:
+        return track in self.original
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            return [record.to_playable() for record in self.records(start, stop)][
+                ::step
+            ]
+        return self.record_at(index).to_playable()
+
+    def __setitem__(self, index, track):
+        if isinstance(index, slice):
+            raise TypeError("slice assignment is not supported")
+        index = self._index(index)
+        old, new = self._order[index], to_record(track)
+        self.original.replace_record(old, new)
+        self._order[index] = new
+        self._drawn.discard(id(old))
+        self._drawn.add(id(new))
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                for i in sorted(range(start, stop, step), reverse=True):
+                    del self[i]
+                return
+            self.delete_range(start, stop)
+            return
+        index = self._index(index)
+        self._forget([self._order.pop(index)])
+
+    def delete_range(self, start: int, stop: int):
+        removed = self.records(start, stop)
+        del self._order[start : start + len(removed)]
+        self._forget(removed)
+
+    def insert(self, index: int, track):
+        self.insert_many(index, [to_record(track)])
+
+    def insert_many(self, index: int, records: list[TrackRecord]):
+        if index < 0:
+            index = max(0, index + len(self))
+        # Appended tracks join the undrawn pool; anything placed at an
+        # explicit position (e.g. !playnext) keeps it.
+        if index < len(self):
+            self._draw(index)
+            self._order[index:index] = records
+            self._drawn.update(id(record) for record in records)
+        self.original.insert_many(min(index, len(self.original)), records)
+
+    def extend(self, tracks):
+        self.original.extend(tracks)
+
+    def append(self, track):
+        self.original.append(track)
+
+    def index(self, track, start: int = 0, stop: int | None = None) -> int:
+        for position, record in enumerate(self._order):
+            if (
+                record.encoded == track.encoded
+                and record.identifier == track.identifier
+            ):
+                if position >= start and (stop is None or position < stop):
+                    return position
+        if len(self._order) < len(self) and track in self.original:
+            self._draw(len(self))
+            return self.index(track, start, stop)
+        raise ValueError(f"{track!r} is not in queue")
+
+    def move(self, start: int, stop: int, to: int):
+        moved = self.records(start, stop)
+        del self._order[start : start + len(moved)]
+        self._draw(to)
+        self._order[to:to] = moved
+
+    def reshuffle(self):
+        self._order = []
+        self._drawn = set()
+
+    def clear(self):
+        self.original.clear()
+        self.reshuffle()
+
+    def copy(self) -> "ShuffledTrackList":
+        copied = ShuffledTrackList(self.original.copy())
+        copied._order = list(self._order)
+        copied._drawn = set(self._drawn)
+        return copied
+
+
+class IndexedQueue(wavelink.Queue):
+    """wavelink.Queue backed by a TrackList instead of a plain list."""
+
+    def __init__(self, *, history: bool = True):
+        super().__init__(history=False)
+        self._items = TrackList()
+        self._history = IndexedQueue(history=False) if history else None
+
+    @property
+    def shuffled(self) -> bool:
+        return isinstance(self._items, ShuffledTrackList)
+
+    def set_shuffle(self, enabled: bool):
+        """Turn lazy shuffle on or off; O(1) either way."""
+        if enabled and not self.shuffled:
+            self._items = ShuffledTrackList(self._items)
+        elif not enabled and self.shuffled:
+            self._items = self._items.original
+
+    def shuffle(self):
+        if self.shuffled:
+            self._items.reshuffle()
+        else:
+            self._items.shuffle()
+
+    def original_records(self) -> list[TrackRecord]:
+        """Queued tracks in the order they were added, shuffled or not."""
+        items = self._items.original if self.shuffled else self._items
+        return items.records()
+
+    def move(self, start: int, stop: int, to: int):
+        self._items.move(start, stop, to)
+
+    def delete_range(self, start: int, stop: int):
+        self._items.delete_range(start, stop)
+
+    def page(self, start: int, size: int) -> list[TrackRecord]:
+        return self._items.records(start, start + size)
+
+    def load_records(self, records: list[TrackRecord]):
+        self._items.insert_many(len(self._items), records)
+        self._wakeup_next()
+
+    def copy(self) -> "IndexedQueue":
+        copied = IndexedQueue(history=self.history is not None)
+        copied._items = self._items.copy()
+        return copied
+
+
+class IdleScheduler:
+    """Hashed timer wheel for idle disconnects.
+
+    Every guild has at most one deadline; rescheduling moves it between two
+    slot sets in O(1). A single sweeper task advances the wheel once per tick
+    and hands expired guilds to the callback.
+    """
+
+    def __init__(self, callback, tick: float = 1.0, slots: int = 1024):
+        self.callback = callback
+        self.tick = tick
+        self._slots: list[set[int]] = [set() for _ in range(slots)]
+        self._deadlines: dict[int, int] = {}
+        self._overrides: dict[int, int] = {}
+        self._cursor = self._now()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def _now(self) -> int:
+        return int(time.monotonic() / self.tick)
+
+    def timeout_for(self, guild_id: int) -> int:
+        return self._overrides.get(guild_id, STANDBY_TIMEOUT)
+
+    def set_timeout(self, guild_id: int, seconds: int | None):
+        if seconds is None:
+            self._overrides.pop(guild_id, None)
+        else:
+            self._overrides[guild_id] = seconds
+
+    def schedule(self, guild_id: int):
+        self.cancel(guild_id)
+        deadline = self._now() + max(
+            1, math.ceil(self.timeout_for(guild_id) / self.tick)
+        )
+        self._deadlines[guild_id] = deadline
+        self._slots[deadline % len(self._slots)].add(guild_id)
+
+    def cancel(self, guild_id: int):
+        deadline = self._deadlines.pop(guild_id, None)
+        if deadline is not None:
+            self._slots[deadline % len(self._slots)].discard(guild_id)
+
+    def start(self):
+        if self._task is None:
+            self._cursor = self._now()
+            self._task = asyncio.create_task(self._sweep())
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            # Catch up on every tick we missed if the loop was stalled.
+            now = self._now()
+            while self._cursor <= now:
+                slot = self._slots[self._cursor % len(self._slots)]
+                expired = [g for g in slot if self._deadlines[g] <= self._cursor]
+                for guild_id in expired:
+                    slot.discard(guild_id)
+                    del self._deadlines[guild_id]
+                    try:
+                        self.callback(guild_id)
+                    except Exception as e:
+                        logger.error(f"Idle callback failed for guild {guild_id}: {e}")
+                self._cursor += 1
+
+
+async def standby(guild_id: int):
+    guild = bot.get_guild(guild_id)
+    if guild and guild.voice_client:
+        player = cast(wavelink.Player, guild.voice_client)
+        if not player.playing:
+            state = guild_states.peek(guild_id)
+            channel = state.home if state else None
+            await player.disconnect()
+            if channel:
+                minutes = idle_scheduler.timeout_for(guild_id) // 60
+                await outbound.send(
+                    channel,
+                    f"{minutes} dakika boyunca hareketsiz kaldım, bu yüzden ayrılıyorum.",
+                )
+
+
+idle_scheduler = IdleScheduler(lambda guild_id: asyncio.create_task(standby(guild_id)))
+
+
+def reset_standby(guild_id: int):
+    idle_scheduler.schedule(guild_id)
+
+
+# Queries that already name a Lavalink search source, e.g. 'ytsearch:"ISRC"'.
+_SEARCH_PREFIX = re.compile(r"^[a-z]+search:")
+_TRACKING_PARAMS = {"si", "feature", "utm_source", "utm_medium", "utm_campaign", "pp"}
+
+
+def normalize_query(query: str) -> str:
+    query = re.sub(r"\s+", " ", query.strip())
+    parts = urlsplit(query)
+    if not (parts.scheme and parts.netloc):
+        return query.casefold()
+    params = [(k, v) for k, v in parse_qsl(parts.query) if k not in _TRACKING_PARAMS]
+    return urlunsplit(
+        (
+            parts.scheme.lower(),
+            parts.netloc.lower(),
+            parts.path.rstrip("/"),
+            urlencode(sorted(params)),
+            "",
+        )
+    )
+
+
+def serialize_search(result: wavelink.Search) -> str:
+    if isinstance(result, wavelink.Playlist):
+        data = {
+            "info": {"name": result.name, "selectedTrack": result.selected},
+            "pluginInfo": {
+                "type": result.type,
+                "url": result.url,
+                "artworkUrl": result.artwork,
+                "author": result.author,
+            },
+            "tracks": [track.raw_data for track in result.tracks],
+        }
+        return json.dumps({"playlist": data})
+    return json.dumps({"tracks": [track.raw_data for track in result]})
+
+
+def deserialize_search(payload: str) -> wavelink.Search:
+    data = json.loads(payload)
+    if "playlist" in data:
+        return wavelink.Playlist(data["playlist"])
+    return [wavelink.Playable(track) for track in data["tracks"]]
+
+
+def copy_search(result: wavelink.Search) -> wavelink.Search:
+    if isinstance(result, wavelink.Playlist):
+        playlist = object.__new__(wavelink.Playlist)
+        for attr in ("name", "selected", "type", "url", "artwork", "author"):
+            setattr(playlist, attr, getattr(result, attr))
+        playlist.tracks = list(result.tracks)
+        return playlist
+    return list(result)
+
+
+class SearchCache:
+    """LRU + SQLite cache in front of wavelink.Playable.search.
+
+    Identical lookups that arrive while one is already in flight wait on the
+    same task instead of hitting Lavalink again. The task is only cancelled
+    once every caller waiting on it has gone, and at most max_lookups of
+    them talk to Lavalink at a time.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        capacity: int,
+        ttl: int,
+        max_lookups: int,
+        max_rows: int = SEARCH_CACHE_MAX_ROWS,
+        purge_every: int = SEARCH_CACHE_PURGE_EVERY,
+    ):
+        self.path = path
+        self.capacity = capacity
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.purge_every = purge_every
+        self._puts = 0
+        self._memory: OrderedDict[str, tuple[float, wavelink.Search]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._waiters: dict[str, int] = {}
+        self._lookups = asyncio.Semaphore(max_lookups)
+        self.lookups_waiting = 0
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache ("
+                "key TEXT PRIMARY KEY, payload TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS search_cache_created "
+                "ON search_cache (created)"
+            )
+            self._purge(self._db)
+        return self._db
+
+    def _purge(self, db: sqlite3.Connection):
+        expired = db.execute(
+            "DELETE FROM search_cache WHERE created < ?", (time.time() - self.ttl,)
+        ).rowcount
+        trimmed = db.execute(
+            "DELETE FROM search_cache WHERE key IN (SELECT key FROM search_cache "
+            "ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,),
+        ).rowcount
+        db.commit()
+        if expired or trimmed:
+            logger.info(
+                f"Search cache purged {expired} expired and {trimmed} excess rows"
+            )
+
+    def _disk_get(self, key: str) -> str | None:
+        with self._db_lock:
+            db = self._connect()
+            row = db.execute(
+                "SELECT payload, created FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[1] > self.ttl:
+                db.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+                db.commit()
+                return None
+            return row[0]
+
+    def _disk_put(self, key: str, payload: str):
+        with self._db_lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO search_cache (key, payload, created) VALUES (?, ?, ?)",
+                (key, payload, time.time()),
+            )
+            db.commit()
+            self._puts += 1
+            if self._puts % self.purge_every == 0:
+                self._purge(db)
+
+    def _memory_get(self, key: str) -> "wavelink.Search | None":
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires, result = entry
+        if expires < time.monotonic():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return result
+
+    def _memory_put(self, key: str, result: wavelink.Search):
+        self._memory[key] = (time.monotonic() + self.ttl, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    @staticmethod
+    def _cacheable(result: wavelink.Search) -> bool:
+        if not result:
+            return False
+        tracks = result.tracks if isinstance(result, wavelink.Playlist) else result
+        return not any(track.is_stream for track in tracks)
+
+    async def search(self, query: str, persist: bool = True) -> wavelink.Search:
+        start = time.perf_counter()
+        outcome = SEARCH_ERROR
+        try:
+            result, outcome = await self._search(query, persist)
+            return result
+        finally:
+            outcome.observe(time.perf_counter() - start)
+
+    async def _search(
+        self, query: str, persist: bool
+    ) -> tuple[wavelink.Search, HistogramChild]:
+        key = normalize_query(query)
+
+        result = self._memory_get(key)
+        if result is not None:
+            self.memory_hits += 1
+            return copy_search(result), SEARCH_MEMORY_HIT
+
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            self.shared += 1
+        else:
+            task = self._inflight[key] = asyncio.create_task(
+                self._load(key, query, persist)
+            )
+            task.add_done_callback(lambda done: self._finished(key, done))
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            result, outcome = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1:
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+        return copy_search(result), SEARCH_SHARED if shared else outcome
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()
+
+    async def _load(
+        self, key: str, query: str, persist: bool
+    ) -> tuple[wavelink.Search, HistogramChild]:
+        try:
+            payload = await asyncio.to_thread(self._disk_get, key)
+        except sqlite3.Error as e:
+            logger.error(f"Search cache read failed: {e}")
+            payload = None
+        if payload is not None:
+            self.disk_hits += 1
+            result = deserialize_search(payload)
+            self._memory_put(key, result)
+            return result, SEARCH_DISK_HIT
+
+        self.misses += 1
+        source = (
+            None if _SEARCH_PREFIX.match(query) else wavelink.TrackSource.YouTubeMusic
+        )
+        self.lookups_waiting += 1
+        try:
+            await self._lookups.acquire()
+        finally:
+            self.lookups_waiting -= 1
+        try:
+            result = await wavelink.Playable.search(
+                query, source=source, node=best_node()
+            )
+        finally:
+            self._lookups.release()
+        if self._cacheable(result):
+            self._memory_put(key, result)
+            if not persist:
+                return result, SEARCH_MISS
+            try:
+                await asyncio.to_thread(self._disk_put, key, serialize_search(result))
+            except sqlite3.Error as e:
+                logger.error(f"Search cache write failed: {e}")
+        return result, SEARCH_MISS if result else SEARCH_EMPTY
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "inflight": len(self._inflight),
+            "lookups_waiting": self.lookups_waiting,
+            "memory_entries": len(self._memory),
+        }
+
+
+search_cache = SearchCache(
+    SEARCH_CACHE_PATH, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, MAX_LOOKUPS
+)
+
+
+_WORD = re.compile(r"\w+")
+
+
+def index_text(text: str) -> str:
+    return " ".join(_WORD.findall(text.casefold()))
+
+
+class TrackIndex:
+    """Word-prefix/trigram index over recently played and searched tracks.
+
+    Holds at most `capacity` tracks and forgets the least recently touched
+    one when full. Queries are answered from memory only, which is what
+    slash command autocomplete needs to stay inside Discord's deadline.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        # key -> [choice label, choice value, normalized text, last touched]
+        self._entries: OrderedDict[str, list] = OrderedDict()
+        self._grams: dict[str, set[str]] = {}
+        self._clock = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def describe(track: wavelink.Playable) -> tuple[str, str, str]:
+        """Return the index key and the autocomplete (label, value) for a track."""
+        key = track.uri or track.identifier
+        label = f"{track.title} — {track.author}" if track.author else track.title
+        if track.uri and len(track.uri) <= 100:
+            value = track.uri
+        else:
+            value = f"{track.author} - {track.title}"[:100]
+        return key, label[:100], value
+
+    @staticmethod
+    def _grams_for(text: str) -> set[str]:
+        grams = {text[i : i + 3] for i in range(len(text) - 2)}
+        for word in text.split():
+            grams.add("^" + word[:1])
+            grams.add("^" + word[:2])
+        return grams
+
+    def add(self, track: wavelink.Playable):
+        self._clock += 1
+        key, label, value = self.describe(track)
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry[3] = self._clock
+            self._entries.move_to_end(key)
+            return
+        text = index_text(f"{track.title} {track.author}")
+        self._entries[key] = [label, value, text, self._clock]
+        for gram in self._grams_for(text):
+            self._grams.setdefault(gram, set()).add(key)
+        while len(self._entries) > self.capacity:
+            old, (_, _, old_text, _) = self._entries.popitem(last=False)
+            for gram in self._grams_for(old_text):
+                keys = self._grams[gram]
+                keys.discard(old)
+                if not keys:
+                    del self._grams[gram]
+
+    def query(self, text: str, limit: int = 25) -> list[tuple[str, str]]:
+        query = index_text(text)
+        if not query:
+            recent = []
+            for label, value, _, _ in reversed(self._entries.values()):
+                if len(recent) == limit:
+                    break
+                recent.append((label, value))
+            return recent
+
+        words = query.split()
+        needed = set()
+        for word in words:
+            if len(word) < 3:
+                needed.add("^" + word)
+            else:
+                needed.update(word[i : i + 3] for i in range(len(word) - 2))
+        sets = sorted((self._grams.get(gram, set()) for gram in needed), key=len)
+        candidates = sets[0].intersection(*sets[1:])
+
+        scored = []
+        for key in candidates:
+            label, value, entry, touched = self._entries[key]
+            if entry.startswith(query):
+                rank = 0
+            elif all(
+                any(part.startswith(word) for part in entry.split()) for word in words
+            ):
+                rank = 1
+            elif all(word in entry for word in words):
+                rank = 2
+            else:
+                continue
+            scored.append((rank, -touched, label, value))
+        scored.sort()
+        return [(label, value) for _, _, label, value in scored[:limit]]
+
+
+track_index = TrackIndex(TRACK_INDEX_SIZE)
+
+
+def remember_tracks(guild_id: int, tracks: list[wavelink.Playable]):
+    state = guild_states.get(guild_id)
+    if state.track_index is None:
+        state.track_index = TrackIndex(GUILD_TRACK_INDEX_SIZE)
+    for track in tracks:
+        state.track_index.add(track)
+        track_index.add(track)
+
+
+# Latest keystroke waiting on the search fallback, per user.
+autocomplete_keystrokes: dict[int, object] = {}
+
+
+async def track_autocomplete(
+    interaction: discord.Interaction, current: str
+) -> list[app_commands.Choice[str]]:
+    start = time.perf_counter()
+    try:
+        return await _track_autocomplete(interaction, current)
+    finally:
+        AUTOCOMPLETE_LATENCY.observe(time.perf_counter() - start)
+
+
+async def _track_autocomplete(
+    interaction: discord.Interaction, current: str
+) -> list[app_commands.Choice[str]]:
+    if current.startswith(("http://", "https://")):
+        return []
+
+    matches: list[tuple[str, str]] = []
+    state = guild_states.peek(interaction.guild_id) if interaction.guild_id else None
+    if state is not None and state.track_index is not None:
+        matches = state.track_index.query(current)
+    seen = {value for _, value in matches}
+    for label, value in track_index.query(current):
+        if len(matches) >= 25:
+            break
+        if value not in seen:
+            seen.add(value)
+            matches.append((label, value))
+
+    # Only go to the search cache (and maybe Lavalink) when nothing local
+    # matches and the user has stopped typing; an abandoned keystroke
+    # cancels its own lookup. These partial queries stay out of the disk
+    # cache.
+    if not matches and len(index_text(current)) >= 3:
+        user_id = interaction.user.id
+        keystroke = autocomplete_keystrokes[user_id] = object()
+        try:
+            await asyncio.sleep(AUTOCOMPLETE_DEBOUNCE)
+            if autocomplete_keystrokes.get(user_id) is not keystroke:
+                return []
+            results = await asyncio.wait_for(
+                search_tracks(current, persist=False), AUTOCOMPLETE_TIMEOUT
+            )
+        except Exception:
+            return []
+        finally:
+            if autocomplete_keystrokes.get(user_id) is keystroke:
+                del autocomplete_keystrokes[user_id]
+        if results and not isinstance(results, wavelink.Playlist):
+            for track in results[:25]:
+                track_index.add(track)
+                matches.append(TrackIndex.describe(track)[1:])
+    return [app_commands.Choice(name=label, value=value) for label, value in matches]
+
+
+class Recommender:
+    """Co-occurrence model over one guild's play history.
+
+    Tracks played within `window` plays of each other strengthen their link,
+    closer plays more so, and the same links are kept between their artists
+    in a small hashed matrix. Each track keeps its top-k neighbours, and only
+    the rows a play touches are refreshed. Memory is fixed by `capacity`:
+    once full, the stalest track's slot is reused.
+    """
+
+    ARTIST_WEIGHT = 0.5
+
+    def __init__(self, capacity: int, window: int = 4, k: int = 16):
+        # Imported here so guilds that never build a model don't pay for it.
+        global np
+        import numpy as np
+
+        self.capacity = capacity
+        self.window = window
+        self.k = min(k, capacity - 1)
+        self.artist_slots = max(16, capacity // 4)
+        self.records: list[TrackRecord | None] = [None] * capacity
+        self.slots: dict[str, int] = {}
+        self.artist_of = np.full(capacity, -1, dtype=np.int32)
+        self.cooc = np.zeros((capacity, capacity), dtype=np.float32)
+        self.artist_cooc = np.zeros(
+            (self.artist_slots, self.artist_slots), dtype=np.float32
+        )
+        self.neighbours = np.full((capacity, self.k), -1, dtype=np.int32)
+        # Play clock value of each slot's last play; 0 marks a free slot.
+        self.last_played = np.zeros(capacity, dtype=np.int64)
+        self.clock = 0
+        self.recent: deque[int] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    @staticmethod
+    def key(track: "wavelink.Playable | TrackRecord") -> str:
+        return track.uri or track.identifier
+
+    def _artist(self, name: str) -> int:
+        return zlib.crc32(name.casefold().encode()) % self.artist_slots
+
+    def _allocate(self, key: str) -> int:
+        slot = int(np.argmin(self.last_played))
+        if self.records[slot] is not None:
+            del self.slots[self.key(self.records[slot])]
+            self.cooc[slot, :] = 0
+            self.cooc[:, slot] = 0
+            self.neighbours[slot] = -1
+            self.neighbours[self.neighbours == slot] = -1
+            if slot in self.recent:
+                self.recent = deque(
+                    (s for s in self.recent if s != slot), maxlen=self.window
+                )
+        self.slots[key] = slot
+        return slot
+
+    def observe(self, track: "wavelink.Playable | TrackRecord"):
+        key = self.key(track)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self._allocate(key)
+        self.records[slot] = to_record(track)
+        self.clock += 1
+        self.last_played[slot] = self.clock
+        artist = self._artist(track.author or "")
+        self.artist_of[slot] = artist
+
+        recent = np.array(self.recent, dtype=np.int32)[::-1]
+        weights = 1.0 / np.arange(1, len(recent) + 1, dtype=np.float32)
+        keep = recent != slot
+        recent, weights = recent[keep], weights[keep]
+        if len(recent):
+            np.add.at(self.cooc[slot], recent, weights)
+            np.add.at(self.cooc[:, slot], recent, weights)
+            others = self.artist_of[recent]
+            np.add.at(self.artist_cooc[artist], others, weights)
+            np.add.at(self.artist_cooc[:, artist], others, weights)
+            self._refresh(np.unique(np.append(recent, slot)))
+        self.recent.append(slot)
+
+    def _refresh(self, rows: "np.ndarray"):
+        scores = self.cooc[rows]
+        top = np.argpartition(-scores, self.k - 1, axis=1)[:, : self.k]
+        top[np.take_along_axis(scores, top, axis=1) <= 0] = -1
+        self.neighbours[rows] = top
+
+    def recommend(
+        self, count: int, exclude: set[str] = frozenset(), min_gap: int = 10
+    ) -> list[TrackRecord]:
+        """Best next tracks for the recent plays, skipping recently played ones."""
+        if not self.recent:
+            return []
+        seeds = np.array(self.recent, dtype=np.int32)[::-1]
+        weights = 1.0 / np.arange(1, len(seeds) + 1, dtype=np.float32)
+        scores = np.zeros(self.capacity, dtype=np.float32)
+
+        neighbours = self.neighbours[seeds]
+        valid = neighbours >= 0
+        links = np.take_along_axis(self.cooc[seeds], np.maximum(neighbours, 0), 1)
+        np.add.at(scores, neighbours[valid], (links * weights[:, None])[valid])
+
+        artists = self.artist_of[seeds]
+        affinity = (self.artist_cooc[artists] * weights[:, None]).sum(axis=0)
+        np.add.at(affinity, artists, weights)
+        known = self.artist_of >= 0
+        scores[known] += self.ARTIST_WEIGHT * affinity[self.artist_of[known]]
+
+        # Small histories would otherwise exclude everything they hold.
+        gap = min(min_gap, max(1, len(self.slots) // 2))
+        scores[self.last_played == 0] = 0
+        scores[self.clock - self.last_played < gap] = 0
+        for key in exclude:
+            slot = self.slots.get(key)
+            if slot is not None:
+                scores[slot] = 0
+
+        count = min(count, self.capacity)
+        best = np.argpartition(-scores, count - 1)[:count]
+        best = best[np.argsort(-scores[best])]
+        return [self.records[slot] for slot in best if scores[slot] > 0]
+
+    def played_recently(self, key: str, min_gap: int = 10) -> bool:
+        slot = self.slots.get(key)
+        return slot is not None and self.clock - self.last_played[slot] < min_gap
+
+
+class RecommenderPool:
+    """Per-guild play history, and Recommenders built from it.
+
+    Every guild keeps its last `history` plays as TrackRecords, so turning
+    autoplay on starts from real history without each guild holding a
+    model. A model is built, replaying that history, once autoplay is on or
+    the history has filled up. Both outlive GuildState so that history
+    survives the bot leaving voice; when over max_guilds models, the least
+    recently active guild without autoplay loses its model first.
+    """
+
+    def __init__(
+        self, max_guilds: int, capacity: int, history: int, max_histories: int
+    ):
+        self.max_guilds = max_guilds
+        self.capacity = capacity
+        self.history = history
+        self.max_histories = max_histories
+        self._models: OrderedDict[int, Recommender] = OrderedDict()
+        self._histories: OrderedDict[int, deque[TrackRecord]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    def observe(self, guild_id: int, track: wavelink.Playable, autoplay: bool = False):
+        history = self._histories.get(guild_id)
+        if history is not None:
+            self._histories.move_to_end(guild_id)
+        else:
+            history = self._histories[guild_id] = deque(maxlen=self.history)
+            if len(self._histories) > self.max_histories:
+                self._histories.popitem(last=False)
+        record = to_record(track)
+        history.append(record)
+        model = self.get(guild_id)
+        if model is not None:
+            model.observe(record)
+        elif autoplay or len(history) == history.maxlen:
+            self.get(guild_id, create=True)
+
+    def get(self, guild_id: int, create: bool = False) -> Recommender | None:
+        model = self._models.get(guild_id)
+        if model is not None:
+            self._models.move_to_end(guild_id)
+        elif create:
+            model = self._models[guild_id] = Recommender(self.capacity)
+            for record in self._histories.get(guild_id, ()):
+                model.observe(record)
+            if len(self._models) > self.max_guilds:
+                self._evict()
+        return model
+
+    def _evict(self):
+        for guild_id in self._models:
+            state = guild_states.peek(guild_id)
+            if state is None or not state.autoplay:
+                del self._models[guild_id]
+                return
+        self._models.popitem(last=False)
+
+
+recommenders = RecommenderPool(
+    RECOMMENDER_GUILDS,
+    RECOMMENDER_SIZE,
+    RECOMMENDER_HISTORY,
+    RECOMMENDER_HISTORY_GUILDS,
+)
+autoplay_stats = {"model": 0, "search": 0, "miss": 0}
+
+
+def owns_guild(guild_id: int) -> bool:
+    shard_count = bot.shard_count or 1
+    shard_ids = getattr(bot, "shard_ids", None)
+    if shard_count == 1 or shard_ids is None:
+        return True
+    return (guild_id >> 22) % shard_count in shard_ids
+
+
+class GuildStateStore:
+    """Write-behind SQLite snapshots of each guild's playback state.
+
+    Handlers only mark a guild dirty. A flusher task snapshots dirty guilds
+    on the loop and writes them in one transaction from a worker thread.
+    Positions of playing guilds are refreshed on every flush with a cheap
+    UPDATE.
+    """
+
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = interval
+        self._dirty: set[int] = set()
+        self._deleted: set[int] = set()
+        self.parked: set[int] = set()
+        self._unavailable: dict[int, tuple[int, dict, int]] = {}
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        self.writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS guild_state ("
+                "guild_id INTEGER PRIMARY KEY, state TEXT NOT NULL, "
+                "position INTEGER NOT NULL, updated REAL NOT NULL)"
+            )
+        return self._db
+
+    def mark_dirty(self, guild_id: int):
+        self._deleted.discard(guild_id)
+        self._dirty.add(guild_id)
+
+    def forget(self, guild_id: int):
+        self._dirty.discard(guild_id)
+        self._deleted.add(guild_id)
+
+    async def park(self, player: wavelink.Player):
+        """Save a player's state now and keep it after the bot leaves voice."""
+        guild_id = player.guild.id
+        self._dirty.discard(guild_id)
+        self._deleted.discard(guild_id)
+        self.parked.add(guild_id)
+        state = (guild_id, self.snapshot(player), player.position)
+        await asyncio.to_thread(self._write, [state], [], [])
+
+    def snapshot(self, player: wavelink.Player) -> dict:
+        state = guild_states.get(player.guild.id)
+        home = state.home
+        return {
+            "channel_id": player.channel.id if player.channel else None,
+            "home_id": home.id if home else None,
+            "current": TrackRecord(player.current).dump() if player.current else None,
+            "queue": [record.dump() for record in player.queue.original_records()],
+            "looping": state.looping,
+            "shuffled": state.shuffled,
+            "volume": player.volume,
+            "paused": player.paused,
+            "filter": state.filter_preset,
+            "autoplay": state.autoplay,
+        }
+
+    def _write(self, states: list[tuple[int, dict, int]], positions, deleted):
+        now = time.time()
+        rows = [(gid, json.dumps(state), pos, now) for gid, state, pos in states]
+        with self._db_lock:
+            db = self._connect()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO guild_state (guild_id, state, position, updated) "
+                    "VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                db.executemany(
+                    "UPDATE guild_state SET position = ?, updated = ? WHERE guild_id = ?",
+                    [(pos, now, gid) for gid, pos in positions],
+                )
+                db.executemany(
+                    "DELETE FROM guild_state WHERE guild_id = ?",
+                    [(gid,) for gid in deleted],
+                )
+
+    def _load(self) -> list[tuple[int, dict, int]]:
+        with self._db_lock:
+            rows = (
+                self._connect()
+                .execute("SELECT guild_id, state, position FROM guild_state")
+                .fetchall()
+            )
+        return [(gid, json.loads(state), pos) for gid, state, pos in rows]
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, set()
+        deleted, self._deleted = self._deleted, set()
+        states = []
+        positions = []
+        for voice_client in bot.voice_clients:
+            player = cast(wavelink.Player, voice_client)
+            guild_id = player.guild.id
+            if guild_id in dirty:
+                states.append((guild_id, self.snapshot(player), player.position))
+            elif player.playing:
+                positions.append((guild_id, player.position))
+        if not (states or positions or deleted):
+            return
+        try:
+            await asyncio.to_thread(self._write, states, positions, deleted)
+            self.writes += 1
+        except sqlite3.Error as e:
+            logger.error(f"Guild state write failed: {e}")
+            self._dirty |= dirty
+            self._deleted |= deleted
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def restore(self) -> tuple[int, float]:
+        start = time.perf_counter()
+        try:
+            saved = await asyncio.to_thread(self._load)
+        except sqlite3.Error as e:
+            logger.error(f"Guild state read failed: {e}")
+            return 0, 0.0
+        return await self._restore_rows(saved), time.perf_counter() - start
+
+    async def resume_parked(self) -> int:
+        parked, self.parked = self.parked, set()
+        if not parked:
+            return 0
+        try:
+            saved = await asyncio.to_thread(self._load)
+        except sqlite3.Error as e:
+            logger.error(f"Guild state read failed: {e}")
+            self.parked |= parked
+            return 0
+        return await self._restore_rows([row for row in saved if row[0] in parked])
+
+    async def _restore_rows(self, rows: list[tuple[int, dict, int]]) -> int:
+        limiter = asyncio.Semaphore(10)
+
+        async def restore_one(guild_id: int, state: dict, position: int) -> bool:
+            async with limiter:
+                try:
+                    return await self._restore_guild(guild_id, state, position)
+                except Exception as e:
+                    logger.error(f"Failed to restore guild {guild_id}: {e}")
+                    return False
+
+        return sum(await asyncio.gather(*(restore_one(*row) for row in rows)))
+
+    async def restore_unavailable(self, guild_id: int) -> bool:
+        row = self._unavailable.pop(guild_id, None)
+        if row is None:
+            return False
+        return await self._restore_rows([row]) > 0
+
+    async def _restore_guild(self, guild_id: int, state: dict, position: int) -> bool:
+        # Workers of a cluster share the file; rows of other shards, and of
+        # guilds that are not available yet, are left for whoever sees them.
+        if not owns_guild(guild_id):
+            return False
+        guild = bot.get_guild(guild_id)
+        if guild is None or guild.unavailable:
+            self._unavailable[guild_id] = (guild_id, state, position)
+            return False
+        if guild.voice_client:
+            return False
+        channel = guild.get_channel(state["channel_id"])
+        if channel is None:
+            self.forget(guild_id)
+            return False
+
+        player = await channel.connect(cls=placed_player())
+        guild_state = guild_states.get(guild_id)
+        if state["home_id"]:
+            guild_state.home = guild.get_channel(state["home_id"])
+        player.queue.load_records(
+            [TrackRecord.load(values) for values in state["queue"]]
+        )
+        guild_state.looping = state["looping"]
+        guild_state.shuffled = state["shuffled"]
+        player.queue.set_shuffle(state["shuffled"])
+        if state["looping"]:
+            player.queue.mode = wavelink.QueueMode.loop
+        preset = state.get("filter", "off")
+        if preset in FILTER_PRESETS:
+            guild_state.filter_preset = preset
+        guild_state.autoplay = state.get("autoplay", False)
+
+        if state["current"]:
+            await player.play(
+                TrackRecord.load(state["current"]).to_playable(),
+                start=position,
+                volume=state["volume"],
+                paused=state["paused"],
+                filters=wavelink.Filters(
+                    data=FILTER_PRESETS[guild_state.filter_preset][1]
+                ),
+            )
+        else:
+            await player.set_volume(state["volume"])
+            reset_standby(guild_id)
+        return True
+
+
+state_store = GuildStateStore(STATE_PATH, STATE_FLUSH_INTERVAL)
+state_restored = False
+restore_stats = {"guilds": 0, "seconds": 0.0}
+
+
+async def search_tracks(query: str, persist: bool = True) -> wavelink.Search:
+    return await search_cache.search(query, persist)
+
+
+def build_nodes() -> list[wavelink.Node]:
+    entries = [e.strip() for e in LAVALINK_NODES.split(",") if e.strip()]
+    if not entries:
+        entries = [f"{LAVALINK_URI}|{LAVALINK_PASSWORD}"]
+    nodes = []
+    for entry in entries:
+        uri, _, password = entry.partition("|")
+        nodes.append(
+            wavelink.Node(
+                identifier=uri,
+                uri=uri,
+                password=password or LAVALINK_PASSWORD,
+            )
+        )
+    return nodes
+
+
+def node_penalty(node: wavelink.Node) -> float:
+    # Same weighting Lavalink clients commonly use: playing players, then CPU,
+    # then frames Lavalink failed to deliver in the last minute.
+    penalty = float(len(node.players))
+    stats = node_stats.get(node.identifier)
+    if stats is None:
+        return penalty
+    penalty = max(penalty, stats.playing)
+    penalty += 1.05 ** (100 * stats.cpu.system_load) * 10 - 10
+    if stats.frames:
+        penalty += 1.03 ** (500 * stats.frames.deficit / 3000) * 600 - 600
+        penalty += (1.03 ** (500 * stats.frames.nulled / 3000) * 300 - 300) * 2
+    return penalty
+
+
+def healthy_nodes(exclude: wavelink.Node | None = None) -> list[wavelink.Node]:
+    nodes = [
+        node
+        for node in wavelink.Pool.nodes.values()
+        if node.status is wavelink.NodeStatus.CONNECTED
+        and (exclude is None or node.identifier != exclude.identifier)
+    ]
+    return sorted(nodes, key=node_penalty)
+
+
+def best_node() -> wavelink.Node:
+    nodes = healthy_nodes()
+    if not nodes:
+        raise wavelink.InvalidNodeException("Bağlı bir Lavalink sunucusu yok.")
+    return nodes[0]
+
+
+def placed_player() -> wavelink.Player:
+    player = wavelink.Player(nodes=[best_node()])
+    player.queue = IndexedQueue()
+    # Let wavelink advance the queue (and honour loop mode) on track end.
+    player.autoplay = wavelink.AutoPlayMode.partial
+    return player
+
+
+async def poll_node_stats():
+    while True:
+        for node in wavelink.Pool.nodes.values():
+            if node.status is not wavelink.NodeStatus.CONNECTED:
+                continue
+            try:
+                node_stats[node.identifier] = await node.fetch_stats()
+            except Exception as e:
+                node_stats.pop(node.identifier, None)
+                logger.error(f"Failed to fetch stats for node {node.identifier}: {e}")
+        await asyncio.sleep(NODE_STATS_INTERVAL)
+
+
+class AdmissionControl:
+    """Decides whether a new voice session may start, based on node stats.
+
+    Each node gets a load ratio: the worst of its players, CPU, lost frames
+    and JVM memory against their limits. From busy_ratio on, optional work
+    (prefetch, many playlists ingesting at once) is cut back; once every
+    node is at 1.0, new sessions wait up to queue_timeout for room and are
+    then turned away. Guilds that already have a player are never held.
+    Sessions that were let in but have not connected yet count as players,
+    so a burst cannot overshoot the limit.
+    """
+
+    OK, BUSY, FULL = 0, 1, 2
+
+    def __init__(
+        self,
+        limits: dict[str, float],
+        busy_ratio: float,
+        queue_timeout: float,
+        busy_ingests: int,
+    ):
+        self.limits = limits
+        self.busy_ratio = busy_ratio
+        self.queue_timeout = queue_timeout
+        self._ingests = asyncio.Semaphore(busy_ingests)
+        self.waiting = 0
+        self.starting = 0
+        self.outcomes = {"admitted": 0, "queued": 0, "shed": 0}
+
+    def node_load(self, node: wavelink.Node, starting: int = 0) -> float:
+        players = len(node.players)
+        signals = {}
+        stats = node_stats.get(node.identifier)
+        if stats is not None:
+            players = max(players, stats.playing)
+            signals["cpu"] = max(stats.cpu.system_load, stats.cpu.lavalink_load)
+            if stats.frames:
+                signals["frame_loss"] = stats.frames.deficit + stats.frames.nulled
+            if stats.memory.reservable:
+                signals["memory"] = stats.memory.used / stats.memory.reservable
+        signals["players"] = players + starting
+        return max(
+            (
+                value / self.limits[name]
+                for name, value in signals.items()
+                if self.limits[name] > 0
+            ),
+            default=0.0,
+        )
+
+    def level(self) -> int:
+        loads = [self.node_load(node, self.starting) for node in healthy_nodes()]
+        if not loads:
+            return self.OK
+        lowest = min(loads)
+        if lowest >= 1:
+            return self.FULL
+        if lowest >= self.busy_ratio:
+            return self.BUSY
+        return self.OK
+
+    @property
+    def busy(self) -> bool:
+        return self.level() >= self.BUSY
+
+    @contextlib.asynccontextmanager
+    async def session(self, on_queued):
+        """Admit a new session; yields whether it may go ahead."""
+        admitted = await self._admit(on_queued)
+        if admitted:
+            self.starting += 1
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self.starting -= 1
+
+    async def _admit(self, on_queued) -> bool:
+        if self.level() < self.FULL:
+            self.outcomes["admitted"] += 1
+            return True
+        self.outcomes["queued"] += 1
+        await on_queued()
+        self.waiting += 1
+        try:
+            deadline = time.monotonic() + self.queue_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(1)
+                if self.level() < self.FULL:
+                    self.outcomes["admitted"] += 1
+                    return True
+        finally:
+            self.waiting -= 1
+        self.outcomes["shed"] += 1
+        return False
+
+    @contextlib.asynccontextmanager
+    async def ingest_slot(self):
+        if not self.busy:
+            yield
+            return
+        async with self._ingests:
+            yield
+
+    def stats(self) -> dict:
+        return {
+            "level": ("ok", "busy", "full")[self.level()],
+            "waiting": self.waiting,
+            "starting": self.starting,
+            "limits": self.limits,
+            "busy_ratio": self.busy_ratio,
+            "nodes": {
+                node.identifier: round(self.node_load(node), 3)
+                for node in wavelink.Pool.nodes.values()
+            },
+            **self.outcomes,
+        }
+
+
+admission = AdmissionControl(
+    {
+        "players": ADMIT_MAX_PLAYERS,
+        "cpu": ADMIT_MAX_CPU,
+        "frame_loss": ADMIT_MAX_FRAME_LOSS,
+        "memory": ADMIT_MAX_MEMORY,
+    },
+    ADMIT_BUSY_RATIO,
+    ADMIT_QUEUE_TIMEOUT,
+    BUSY_INGEST_LIMIT,
+)
+
+
+class Throttle:
+    """Token buckets per (user, command class) and (guild, command class).
+
+    A call must fit in both of its buckets and is charged to both, or to
+    neither. Buckets that have refilled completely carry no state, so they
+    are dropped from the front of the LRU as calls come in, and the oldest
+    go first if there are ever more than `max_keys`.
+    """
+
+    def __init__(self, limits: dict[str, tuple[float, float]], max_keys: int):
+        # scope -> (burst, tokens per second)
+        self.limits = limits
+        self.max_keys = max_keys
+        # (scope, id, command class) -> [tokens, updated]
+        self._buckets: OrderedDict[tuple, list] = OrderedDict()
+        self.throttled: dict[tuple[str, str], int] = {}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _bucket(self, key: tuple, now: float) -> list:
+        bucket = self._buckets.get(key)
+        burst, rate = self.limits[key[0]]
+        if bucket is None:
+            bucket = self._buckets[key] = [burst, now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _evict(self, now: float):
+        for _ in range(2):
+            if not self._buckets:
+                return
+            key, (tokens, updated) = next(iter(self._buckets.items()))
+            burst, rate = self.limits[key[0]]
+            if len(self._buckets) <= self.max_keys and (
+                tokens + (now - updated) * rate < burst
+            ):
+                return
+            del self._buckets[key]
+
+    def take(self, user_id: int, guild_id: int | None, kind: str, cost: float) -> float:
+        """Charge `cost`; returns 0 if allowed, else seconds until it would be."""
+        now = time.monotonic()
+        self._evict(now)
+        keys = [("user", user_id, kind)]
+        if guild_id is not None:
+            keys.append(("guild", guild_id, kind))
+        wait = 0.0
+        buckets = []
+        for key in keys:
+            bucket = self._bucket(key, now)
+            buckets.append(bucket)
+            if bucket[0] < cost:
+                burst, rate = self.limits[key[0]]
+                wait = max(wait, (cost - bucket[0]) / rate)
+                counter = (key[0], kind)
+                self.throttled[counter] = self.throttled.get(counter, 0) + 1
+        if wait:
+            return wait
+        for bucket in buckets:
+            bucket[0] -= cost
+        return 0.0
+
+
+# Commands are charged to their class; anything not listed is a "command".
+THROTTLE_CLASSES = {
+    "play": "play",
+    "playnext": "play",
+    "playnow": "play",
+    "search": "search",
+}
+THROTTLE_COSTS = {
+    "command": 1,
+    "control": 1,
+    "play": 1,
+    "playlist": 5,
+    "search": 2,
+}
+_PLAYLIST_QUERY = re.compile(r"/(playlist|album|artist)/|[?&]list=")
+
+throttle = Throttle(
+    {
+        "user": (THROTTLE_USER_BURST, THROTTLE_USER_RATE),
+        "guild": (THROTTLE_GUILD_BURST, THROTTLE_GUILD_RATE),
+    },
+    THROTTLE_MAX_KEYS,
 )
-logger = logging.getLogger(__name__)
 
-load_dotenv()
 
-DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
-LAVALINK_URI = os.getenv("LAVALINK_URI", "http://localhost:2333")
-LAVALINK_PASSWORD = os.getenv("LAVALINK_PASSWORD", "youshallnotpass")
+class Throttled(commands.CheckFailure):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Throttled, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
 
-intents = discord.Intents.default()
-intents.voice_states = True
-intents.message_content = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
-bot.remove_command("help")
+def throttle_message(retry_after: float) -> str:
+    return f"Çok hızlı gidiyorsun, {math.ceil(retry_after)} saniye sonra tekrar dene."
 
-STANDBY_TIMEOUT = 900
-standby_tasks: dict[int, asyncio.Task] = {}
-current_messages: dict[int, discord.Message] = {}
-is_looping: dict[int, bool] = {}
-is_shuffled: dict[int, bool] = {}
 
+@bot.check
+async def throttle_commands(ctx) -> bool:
+    kind = THROTTLE_CLASSES.get(ctx.command.qualified_name, "command")
+    cost = THROTTLE_COSTS[kind]
+    if kind == "play":
+        if ctx.interaction is not None:
+            text = " ".join(str(value) for _, value in ctx.interaction.namespace)
+        else:
+            text = ctx.message.content
+        if _PLAYLIST_QUERY.search(text):
+            cost = THROTTLE_COSTS["playlist"]
+    retry_after = throttle.take(
+        ctx.author.id, ctx.guild.id if ctx.guild else None, kind, cost
+    )
+    if retry_after:
+        raise Throttled(retry_after)
+    return True
 
-def get_player(ctx_or_interaction) -> wavelink.Player | None:
-    if isinstance(ctx_or_interaction, commands.Context):
-        guild = ctx_or_interaction.guild
-    else:
-        guild = ctx_or_interaction.guild
-    if guild and guild.voice_client:
-        return cast(wavelink.Player, guild.voice_client)
-    return None
 
+async def failover_player(player: wavelink.Player, dead: wavelink.Node):
+    guild_id = player.guild.id if player.guild else None
+    candidates = healthy_nodes(exclude=dead)
+    if not candidates:
+        logger.warning(
+            f"No healthy node for guild {guild_id}, waiting for {dead.identifier} to resume"
+        )
+        return
+    for node in candidates:
+        try:
+            await player.switch_node(node)
+        except (
+            RuntimeError,
+            wavelink.WavelinkException,
+            aiohttp.ClientError,
+            asyncio.TimeoutError,
+        ) as e:
+            logger.error(
+                f"Failover of guild {guild_id} to {node.identifier} failed: {e!r}"
+            )
+            continue
+        logger.info(
+            f"Moved guild {guild_id} from {dead.identifier} to {node.identifier} "
+            f"at {player.position}ms"
+        )
+        return
+
+    # A half-switched player is stale in both wavelink and discord.py, so
+    # leave voice and pick the saved state up again once a node is back.
+    logger.error(f"Failover of guild {guild_id} failed on every node, disconnecting")
+    try:
+        await state_store.park(player)
+    except sqlite3.Error as e:
+        logger.error(f"Failed to save state of guild {guild_id}: {e}")
+    try:
+        await player.disconnect()
+    except Exception as e:
+        logger.error(f"Failed to disconnect guild {guild_id}: {e!r}")
 
-def format_duration(ms: int) -> str:
-    seconds = ms // 1000
-    minutes = seconds // 60
-    seconds = seconds % 60
-    return f"{minutes}:{seconds:02d}"
 
+def equalizer(*gains: float) -> list[dict]:
+    # wavelink.Filters drops an equalizer payload that is not all 15 bands,
+    # which would strip the EQ from restored and failed-over players.
+    gains += (0.0,) * (15 - len(gains))
+    return [{"band": band, "gain": gain} for band, gain in enumerate(gains)]
 
-async def standby(guild_id: int):
-    await asyncio.sleep(STANDBY_TIMEOUT)
+
+# Raw Lavalink filter payloads, built once; "off" clears every filter.
+FILTER_PRESETS: dict[str, tuple[str, dict]] = {
+    "off": ("Efekt Yok", {}),
+    "bassboost": (
+        "Bass Boost",
+        {"equalizer": equalizer(0.25, 0.2, 0.15, 0.1, 0.05)},
+    ),
+    "nightcore": (
+        "Nightcore",
+        {"timescale": {"speed": 1.2, "pitch": 1.2, "rate": 1.0}},
+    ),
+    "vaporwave": (
+        "Vaporwave",
+        {
+            "timescale": {"speed": 0.85, "pitch": 0.8, "rate": 1.0},
+            "equalizer": equalizer(0.15, 0.15),
+        },
+    ),
+    "8d": ("8D", {"rotation": {"rotationHz": 0.2}}),
+    "karaoke": (
+        "Karaoke",
+        {
+            "karaoke": {
+                "level": 1.0,
+                "monoLevel": 1.0,
+                "filterBand": 220.0,
+                "filterWidth": 100.0,
+            }
+        },
+    ),
+    "soft": ("Soft", {"lowPass": {"smoothing": 20.0}}),
+}
+
+
+def queue_player_update(
+    player: wavelink.Player,
+    *,
+    volume: int | None = None,
+    paused: bool | None = None,
+    preset: str | None = None,
+):
+    """Apply a volume/pause/filter change locally and queue it for Lavalink.
+
+    Changes made within PLAYER_UPDATE_WINDOW of each other go out as one
+    player PATCH; a change that is undone inside the window (a double click
+    on pause) sends nothing.
+    """
+    guild_id = player.guild.id
+    state = guild_states.get(guild_id)
+    pending = state.pending_update
+    # wavelink only sets these after its own PATCH returns. Setting them now
+    # lets the next click, the panel and the status button see queued values.
+    if volume is not None:
+        pending.setdefault("volume", player.volume)
+        player._volume = volume
+    if paused is not None:
+        pending.setdefault("paused", player.paused)
+        player._paused = paused
+    if preset is not None:
+        pending.setdefault("filters", state.filter_preset)
+        state.filter_preset = preset
+        player._filters = wavelink.Filters(data=FILTER_PRESETS[preset][1])
+    state_store.mark_dirty(guild_id)
+    if state.update_flush is None:
+        state.update_flush = asyncio.get_running_loop().call_later(
+            PLAYER_UPDATE_WINDOW,
+            lambda: asyncio.create_task(flush_player_update(guild_id)),
+        )
+
+
+async def flush_player_update(guild_id: int):
+    state = guild_states.peek(guild_id)
+    if state is None:
+        return
+    state.update_flush = None
+    pending, state.pending_update = state.pending_update, {}
     guild = bot.get_guild(guild_id)
-    if guild and guild.voice_client:
-        player = cast(wavelink.Player, guild.voice_client)
-        if not player.playing:
-            channel = player.home if hasattr(player, "home") else None
-            await player.disconnect()
-            if channel:
-                await channel.send(
-                    "15 dakika boyunca hareketsiz kaldım, bu yüzden ayrılıyorum."
-                )
+    if not guild or not guild.voice_client:
+        return
+    player = cast(wavelink.Player, guild.voice_client)
+
+    data = {}
+    if "volume" in pending and pending["volume"] != player.volume:
+        data["volume"] = player.volume
+    if "paused" in pending and pending["paused"] != player.paused:
+        data["paused"] = player.paused
+    if "filters" in pending and pending["filters"] != state.filter_preset:
+        data["filters"] = FILTER_PRESETS[state.filter_preset][1]
+    if not data:
+        return
+    try:
+        await player.node._update_player(guild_id, data=data)
+    except Exception as e:
+        logger.error(f"Failed to update player in guild {guild_id}: {e}")
+        rollback_player_update(player, state, pending)
+
+
+def rollback_player_update(player: wavelink.Player, state: "GuildState", sent: dict):
+    """Put back the values a failed PATCH was meant to replace.
 
+    A field changed again since the PATCH went out stays as the user set it;
+    its next flush just compares against what Lavalink still has.
+    """
+    queued = state.pending_update
+    for field, previous in sent.items():
+        if field in queued:
+            queued[field] = previous
+        elif field == "volume":
+            player._volume = previous
+        elif field == "paused":
+            player._paused = previous
+        else:
+            state.filter_preset = previous
+            player._filters = wavelink.Filters(data=FILTER_PRESETS[previous][1])
+    state_store.mark_dirty(player.guild.id)
+    update_panel(player)
+
+
+class OutboundOp:
+    __slots__ = ("priority", "key", "call", "kwargs", "future")
+
+    def __init__(self, priority: int, key, call, kwargs: dict):
+        self.priority = priority
+        self.key = key
+        self.call = call
+        self.kwargs = kwargs
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Merged and shed callers may be gone by the time this resolves.
+        self.future.add_done_callback(
+            lambda future: future.cancelled() or future.exception()
+        )
+
+
+class Outbox:
+    __slots__ = ("heap", "keyed", "worker", "sent_at", "deletes", "delete_flush")
+
+    def __init__(self):
+        self.heap: list[tuple[int, int, OutboundOp]] = []
+        self.keyed: dict = {}
+        self.worker: asyncio.Task | None = None
+        self.sent_at: deque[float] = deque()
+        # (due, message id, fallback delete)
+        self.deletes: list[tuple[float, int, object]] = []
+        self.delete_flush: asyncio.TimerHandle | None = None
+
+
+class OutboundScheduler:
+    """Channel message traffic, one request at a time per channel by priority.
+
+    Discord rate-limits messages per channel, so each channel gets its own
+    outbox. Ops sharing a key while still pending are merged (edits keep
+    the newest value of each field) and every caller gets the one result.
+    LOW ops are shed instead of queued once the channel has used its
+    estimated bucket or the outbox is full. Scheduled deletions are
+    collected for OUTBOUND_DELETE_WINDOW and bulk-deleted when the bot may
+    manage messages there.
+    """
+
+    CRITICAL, NORMAL, LOW = 0, 1, 2
+
+    def __init__(self, rate: int, per: float, max_depth: int, delete_window: float):
+        self.rate = rate
+        self.per = per
+        self.max_depth = max_depth
+        self.delete_window = delete_window
+        self._outboxes: dict[int, Outbox] = {}
+        self._seq = 0
+        self.merged = 0
+        self.shed = 0
+        self.bulk_deletes = 0
+        self.deleted = 0
+
+    @staticmethod
+    def _pending(box: Outbox):
+        # A promoted op leaves its old heap entry behind; only the entry
+        # matching its current priority counts.
+        for priority, _, op in box.heap:
+            if priority == op.priority and not op.future.done():
+                yield op
+
+    def depth(self) -> dict[int, int]:
+        counts = {self.CRITICAL: 0, self.NORMAL: 0, self.LOW: 0}
+        for box in self._outboxes.values():
+            for op in self._pending(box):
+                counts[op.priority] += 1
+        return counts
+
+    def _saturated(self, box: Outbox) -> bool:
+        now = time.monotonic()
+        while box.sent_at and now - box.sent_at[0] > self.per:
+            box.sent_at.popleft()
+        return len(box.sent_at) >= self.rate
+
+    def _outbox(self, channel_id: int) -> Outbox:
+        box = self._outboxes.get(channel_id)
+        if box is None:
+            box = self._outboxes[channel_id] = Outbox()
+        return box
+
+    async def submit(self, channel_id: int, priority: int, key, call, kwargs: dict):
+        box = self._outbox(channel_id)
+        op = box.keyed.get(key) if key is not None else None
+        if op is not None:
+            op.kwargs.update(kwargs)
+            self.merged += 1
+            if priority < op.priority:
+                op.priority = priority
+                self._push(box, op)
+        else:
+            pending = sum(1 for _ in self._pending(box))
+            if priority == self.LOW and (
+                pending >= self.max_depth or self._saturated(box)
+            ):
+                self.shed += 1
+                return None
+            if pending >= self.max_depth:
+                self._shed_one(box)
+            op = OutboundOp(priority, key, call, kwargs)
+            if key is not None:
+                box.keyed[key] = op
+            self._push(box, op)
+            if box.worker is None:
+                box.worker = asyncio.create_task(self._drain(channel_id, box))
+        return await asyncio.shield(op.future)
+
+    def _push(self, box: Outbox, op: OutboundOp):
+        self._seq += 1
+        heapq.heappush(box.heap, (op.priority, self._seq, op))
+
+    def _shed_one(self, box: Outbox):
+        for _, _, op in sorted(box.heap, reverse=True):
+            if op.priority == self.LOW and not op.future.done():
+                box.keyed.pop(op.key, None)
+                op.future.set_result(None)
+                self.shed += 1
+                return
+
+    async def _drain(self, channel_id: int, box: Outbox):
+        try:
+            while box.heap:
+                _, _, op = heapq.heappop(box.heap)
+                if op.future.done():
+                    continue
+                if op.key is not None and box.keyed.get(op.key) is op:
+                    del box.keyed[op.key]
+                box.sent_at.append(time.monotonic())
+                try:
+                    result = await op.call(**op.kwargs)
+                except Exception as e:
+                    if not op.future.done():
+                        op.future.set_exception(e)
+                else:
+                    if not op.future.done():
+                        op.future.set_result(result)
+        finally:
+            box.worker = None
+            # Kept around until its sends have aged out of the bucket window.
+            asyncio.get_running_loop().call_later(
+                self.per, self._release, channel_id, box
+            )
+
+    def _release(self, channel_id: int, box: Outbox):
+        if (
+            self._outboxes.get(channel_id) is box
+            and box.worker is None
+            and not box.heap
+            and not box.deletes
+            and not (self._saturated(box) or box.sent_at)
+        ):
+            del self._outboxes[channel_id]
+
+    async def send(
+        self,
+        channel: discord.abc.Messageable,
+        content: str | None = None,
+        *,
+        priority: int = NORMAL,
+        key=None,
+        **kwargs,
+    ) -> discord.Message | None:
+        if content is not None:
+            kwargs["content"] = content
+        return await self.submit(
+            channel.id, priority, ("send", key) if key else None, channel.send, kwargs
+        )
+
+    async def edit(
+        self, message: discord.Message, *, priority: int = NORMAL, **kwargs
+    ) -> discord.Message | None:
+        return await self.submit(
+            message.channel.id, priority, ("edit", message.id), message.edit, kwargs
+        )
+
+    async def delete(self, message: discord.Message, *, priority: int = NORMAL):
+        return await self.submit(
+            message.channel.id, priority, ("delete", message.id), message.delete, {}
+        )
+
+    def delete_later(self, channel, message_id: int, delay: float, fallback):
+        """Delete a message after `delay`; `fallback()` deletes it on its own."""
+        box = self._outbox(channel.id)
+        box.deletes.append(
+            (asyncio.get_running_loop().time() + delay, message_id, fallback)
+        )
+        self._schedule_deletes(channel, box)
+
+    def _schedule_deletes(self, channel, box: Outbox):
+        loop = asyncio.get_running_loop()
+        when = min(entry[0] for entry in box.deletes) + self.delete_window
+        if box.delete_flush is not None:
+            if box.delete_flush.when() <= when:
+                return
+            box.delete_flush.cancel()
+        box.delete_flush = loop.call_at(
+            when, lambda: asyncio.create_task(self._flush_deletes(channel))
+        )
+
+    async def _flush_deletes(self, channel):
+        box = self._outboxes.get(channel.id)
+        if box is None:
+            return
+        box.delete_flush = None
+        # Anything due within the next window rides along with this batch.
+        cutoff = asyncio.get_running_loop().time() + self.delete_window
+        due = [entry for entry in box.deletes if entry[0] <= cutoff]
+        box.deletes = [entry for entry in box.deletes if entry[0] > cutoff]
+        if box.deletes:
+            self._schedule_deletes(channel, box)
+        else:
+            self._release(channel.id, box)
+
+        me = getattr(channel.guild, "me", None)
+        can_bulk = (
+            len(due) > 1
+            and me is not None
+            and channel.permissions_for(me).manage_messages
+        )
+        if can_bulk:
+            for start in range(0, len(due), 100):
+                chunk = due[start : start + 100]
+                try:
+                    await self.submit(
+                        channel.id,
+                        self.NORMAL,
+                        None,
+                        channel.delete_messages,
+                        {"messages": [discord.Object(id=entry[1]) for entry in chunk]},
+                    )
+                    self.bulk_deletes += 1
+                    self.deleted += len(chunk)
+                except discord.HTTPException as e:
+                    logger.error(f"Bulk delete failed in channel {channel.id}: {e}")
+            return
+        for _, _, fallback in due:
+            try:
+                await fallback()
+                self.deleted += 1
+            except discord.HTTPException:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth(),
+            "merged": self.merged,
+            "shed": self.shed,
+            "bulk_deletes": self.bulk_deletes,
+            "deleted": self.deleted,
+        }
+
+
+outbound = OutboundScheduler(
+    OUTBOUND_RATE, OUTBOUND_PER, OUTBOUND_MAX_DEPTH, OUTBOUND_DELETE_WINDOW
+)
+
+
+async def post(
+    ctx,
+    content: str | None = None,
+    *,
+    priority: int = OutboundScheduler.NORMAL,
+    key=None,
+    **kwargs,
+):
+    """ctx.send for prefix commands goes through the outbound scheduler.
+
+    Slash command replies are interaction followups with their own limits
+    and are sent directly.
+    """
+    if ctx.interaction is not None:
+        return await ctx.send(content, **kwargs)
+    return await outbound.send(
+        ctx.channel, content, priority=priority, key=key, **kwargs
+    )
+
+
+async def reply_briefly(interaction: discord.Interaction, content: str, delay: float):
+    """Answer a button press and have the reply cleaned up after `delay`."""
+    response = await interaction.response.send_message(content)
+    message_id = getattr(response, "message_id", None)
+    if message_id is None or interaction.channel is None:
+        return
+    outbound.delete_later(
+        interaction.channel, message_id, delay, interaction.delete_original_response
+    )
+
+
+class ControlView(View):
+    """Base of every button view: tags the log context and throttles presses."""
+
+    throttle_class = "control"
 
-async def reset_standby(guild_id: int):
-    if guild_id in standby_tasks:
-        standby_tasks[guild_id].cancel()
-    standby_tasks[guild_id] = asyncio.create_task(standby(guild_id))
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        custom_id = (interaction.data or {}).get("custom_id")
+        log_context(guild=interaction.guild_id, command=custom_id)
+        if event_trace is not None and interaction.guild_id:
+            event_trace.record(
+                "btn", interaction.guild_id, interaction.user.id, id=custom_id
+            )
+        retry_after = throttle.take(
+            interaction.user.id,
+            interaction.guild_id,
+            self.throttle_class,
+            THROTTLE_COSTS[self.throttle_class],
+        )
+        if retry_after:
+            await interaction.response.send_message(
+                throttle_message(retry_after), ephemeral=True
+            )
+            return False
+        return True
 
 
-class MusicControls(View):
+class MusicControls(ControlView):
     def __init__(self):
         super().__init__(timeout=None)
 
-    @discord.ui.button(label="Skip", style=discord.ButtonStyle.red)
+    @discord.ui.button(
+        label="Skip", style=discord.ButtonStyle.red, custom_id="music:skip"
+    )
     async def skip(self, interaction: discord.Interaction, button: Button):
         player = get_player(interaction)
         if player and player.playing:
             await player.skip(force=True)
-            await interaction.response.send_message("Şarkı atlandı!", delete_after=2)
+            await reply_briefly(interaction, "Şarkı atlandı!", 2)
         else:
-            await interaction.response.send_message(
-                "Şu anda çalan bir şarkı yok.", delete_after=5
-            )
+            await reply_briefly(interaction, "Şu anda çalan bir şarkı yok.", 5)
 
-    @discord.ui.button(label="Oynat/Duraklat", style=discord.ButtonStyle.blurple)
+    @discord.ui.button(
+        label="Oynat/Duraklat",
+        style=discord.ButtonStyle.blurple,
+        custom_id="music:pause",
+    )
     async def pause_resume(self, interaction: discord.Interaction, button: Button):
         player = get_player(interaction)
         if player and player.playing:
-            await player.pause(not player.paused)
-            guild_id = interaction.guild.id
-            if guild_id in current_messages:
-                try:
-                    msg = current_messages[guild_id]
-                    embed = msg.embeds[0]
-                    status = "⏸️ Paused" if player.paused else "▶️ Playing"
-                    embed.set_field_at(0, name="Status", value=status, inline=True)
-                    await msg.edit(embed=embed)
-                except Exception:
-                    pass
+            queue_player_update(player, paused=not player.paused)
+            update_panel(player)
             state = "duraklatıldı" if player.paused else "devam ediyor"
-            await interaction.response.send_message(f"Şarkı {state}.", delete_after=5)
+            await reply_briefly(interaction, f"Şarkı {state}.", 5)
         else:
-            await interaction.response.send_message(
-                "Şu anda çalan bir şarkı yok.", delete_after=5
-            )
+            await reply_briefly(interaction, "Şu anda çalan bir şarkı yok.", 5)
 
-    @discord.ui.button(label="Durdur", style=discord.ButtonStyle.grey)
+    @discord.ui.button(
+        label="Durdur", style=discord.ButtonStyle.grey, custom_id="music:stop"
+    )
     async def stop(self, interaction: discord.Interaction, button: Button):
         player = get_player(interaction)
         if player and player.connected:
+            cancel_ingest(interaction.guild.id)
             player.queue.clear()
             await player.disconnect()
             guild_id = interaction.guild.id
-            if guild_id in current_messages:
-                try:
-                    await current_messages[guild_id].delete()
-                except Exception:
-                    pass
-                del current_messages[guild_id]
+            idle_scheduler.cancel(guild_id)
+            await clear_panel(guild_id)
             await interaction.response.send_message(
                 "Müzik durduruldu ve bağlantı kesildi."
             )
         else:
-            await interaction.response.send_message(
-                "Zaten bir ses kanalında değilim.", delete_after=5
-            )
+            await reply_briefly(interaction, "Zaten bir ses kanalında değilim.", 5)
 
-    @discord.ui.button(label="Siradakiler", style=discord.ButtonStyle.green)
+    @discord.ui.button(
+        label="Siradakiler", style=discord.ButtonStyle.green, custom_id="music:queue"
+    )
     async def queue_list(self, interaction: discord.Interaction, button: Button):
         player = get_player(interaction)
         if not player or player.queue.is_empty:
-            await interaction.response.send_message(
-                "Kuyruk şu anda boş.", delete_after=5
-            )
+            await reply_briefly(interaction, "Kuyruk şu anda boş.", 5)
             return
-        queue_str = "\n".join(
-            [f"{i + 1}. {track.title}" for i, track in enumerate(player.queue)]
-        )
+        view = QueueView(player)
         await interaction.response.send_message(
-            f"Şarkı Kuyruğu:\n{queue_str}", delete_after=10
+            embed=view.render(), view=view, ephemeral=True
         )
 
-    @discord.ui.button(label="Sirayi Temizle", style=discord.ButtonStyle.red)
+    @discord.ui.button(
+        label="Sirayi Temizle", style=discord.ButtonStyle.red, custom_id="music:clear"
+    )
     async def clear(self, interaction: discord.Interaction, button: Button):
         player = get_player(interaction)
         if player:
+            cancel_ingest(interaction.guild.id)
             player.queue.clear()
-        await interaction.response.send_message("Kuyruk temizlendi.", delete_after=5)
+            update_panel(player)
+            queue_drained(player)
+        await reply_briefly(interaction, "Kuyruk temizlendi.", 5)
+
+
+class QueueView(ControlView):
+    PAGE_SIZE = 10
+
+    def __init__(self, player: wavelink.Player):
+        super().__init__(timeout=120)
+        self.player = player
+        self.page = 0
+
+    def pages(self) -> int:
+        return max(1, math.ceil(self.player.queue.count / self.PAGE_SIZE))
+
+    def render(self) -> discord.Embed:
+        self.page = min(self.page, self.pages() - 1)
+        start = self.page * self.PAGE_SIZE
+        lines = [
+            f"{start + i + 1}. {record.title}"
+            for i, record in enumerate(self.player.queue.page(start, self.PAGE_SIZE))
+        ]
+        embed = discord.Embed(
+            title="Şarkı Kuyruğu",
+            description="\n".join(lines) or "Kuyruk şu anda boş.",
+            color=discord.Color.green(),
+        )
+        embed.set_footer(
+            text=f"Sayfa {self.page + 1}/{self.pages()} | {self.player.queue.count} şarkı"
+        )
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.pages() - 1
+        return embed
+
+    @discord.ui.button(label="Önceki", style=discord.ButtonStyle.grey)
+    async def previous_page(self, interaction: discord.Interaction, button: Button):
+        self.page = max(0, self.page - 1)
+        await interaction.response.edit_message(embed=self.render(), view=self)
 
+    @discord.ui.button(label="Sonraki", style=discord.ButtonStyle.grey)
+    async def next_page(self, interaction: discord.Interaction, button: Button):
+        self.page += 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
 
-class ExtraControls(View):
+
+class ExtraControls(ControlView):
     def __init__(self):
         super().__init__(timeout=None)
 
-    @discord.ui.button(label="Loop", style=discord.ButtonStyle.blurple)
+    @discord.ui.button(
+        label="Loop", style=discord.ButtonStyle.blurple, custom_id="extra:loop"
+    )
     async def loop(self, interaction: discord.Interaction, button: Button):
         guild_id = interaction.guild.id
         player = get_player(interaction)
+        looping = False
         if player:
-            current = is_looping.get(guild_id, False)
-            is_looping[guild_id] = not current
-            if is_looping[guild_id]:
+            guild_state = guild_states.get(guild_id)
+            guild_state.looping = looping = not guild_state.looping
+            if looping:
                 player.queue.mode = wavelink.QueueMode.loop
             else:
                 player.queue.mode = wavelink.QueueMode.normal
-        state = "açık" if is_looping.get(guild_id, False) else "kapalı"
-        await interaction.response.send_message(f"Döngü modu {state}.", delete_after=5)
+            state_store.mark_dirty(guild_id)
+        state = "açık" if looping else "kapalı"
+        await reply_briefly(interaction, f"Döngü modu {state}.", 5)
 
-    @discord.ui.button(label="Shuffle", style=discord.ButtonStyle.blurple)
+    @discord.ui.button(
+        label="Shuffle", style=discord.ButtonStyle.blurple, custom_id="extra:shuffle"
+    )
     async def shuffle(self, interaction: discord.Interaction, button: Button):
         guild_id = interaction.guild.id
         player = get_player(interaction)
-        current = is_shuffled.get(guild_id, False)
-        is_shuffled[guild_id] = not current
-        if is_shuffled[guild_id] and player and not player.queue.is_empty:
-            player.queue.shuffle()
-        state = "açık" if is_shuffled[guild_id] else "kapalı"
-        await interaction.response.send_message(
-            f"Karıştırma modu {state}.", delete_after=5
-        )
+        guild_state = guild_states.get(guild_id)
+        guild_state.shuffled = not guild_state.shuffled
+        if player:
+            player.queue.set_shuffle(guild_state.shuffled)
+        state_store.mark_dirty(guild_id)
+        state = "açık" if guild_state.shuffled else "kapalı"
+        await reply_briefly(interaction, f"Karıştırma modu {state}.", 5)
 
-    @discord.ui.button(label="Durum", style=discord.ButtonStyle.green)
+    @discord.ui.button(
+        label="Durum", style=discord.ButtonStyle.green, custom_id="extra:status"
+    )
     async def status(self, interaction: discord.Interaction, button: Button):
         player = get_player(interaction)
         if not player or not player.connected:
-            await interaction.response.send_message(
-                "Şu anda bir ses kanalına bağlı değilim.", delete_after=5
+            await reply_briefly(
+                interaction, "Şu anda bir ses kanalına bağlı değilim.", 5
             )
             return
-        guild_id = interaction.guild.id
+        state = guild_states.get(interaction.guild.id)
         status_msg = [
             f"Bağlı kanal: {player.channel.name}",
             f"Çalıyor: {player.playing}",
             f"Duraklatıldı: {player.paused}",
             f"Kuyrukta {player.queue.count} şarkı var",
-            f"Karıştırılmış: {is_shuffled.get(guild_id, False)}",
-            f"Döngü: {is_looping.get(guild_id, False)}",
+            f"Karıştırılmış: {state.shuffled}",
+            f"Döngü: {state.looping}",
             f"Ses seviyesi: {player.volume}%",
+            f"Efekt: {FILTER_PRESETS[state.filter_preset][0]}",
         ]
-        await interaction.response.send_message("\n".join(status_msg), delete_after=10)
+        await reply_briefly(interaction, "\n".join(status_msg), 10)
 
-    @discord.ui.button(label="Ses Arttir", style=discord.ButtonStyle.grey)
+    @discord.ui.button(
+        label="Ses Arttir", style=discord.ButtonStyle.grey, custom_id="extra:volume_up"
+    )
     async def volume_up(self, interaction: discord.Interaction, button: Button):
         player = get_player(interaction)
         if not player or not player.playing:
-            await interaction.response.send_message(
-                "Şu anda müzik çalmıyor.", delete_after=5
-            )
+            await reply_briefly(interaction, "Şu anda müzik çalmıyor.", 5)
             return
         new_volume = min(100, player.volume + 10)
-        await player.set_volume(new_volume)
-        await interaction.response.send_message(
-            f"Ses seviyesi {new_volume}% olarak ayarlandı.", delete_after=5
+        queue_player_update(player, volume=new_volume)
+        await reply_briefly(
+            interaction, f"Ses seviyesi {new_volume}% olarak ayarlandı.", 5
         )
 
-    @discord.ui.button(label="Ses Dusur", style=discord.ButtonStyle.grey)
+    @discord.ui.button(
+        label="Ses Dusur", style=discord.ButtonStyle.grey, custom_id="extra:volume_down"
+    )
     async def volume_down(self, interaction: discord.Interaction, button: Button):
         player = get_player(interaction)
         if not player or not player.playing:
-            await interaction.response.send_message(
-                "Şu anda müzik çalmıyor.", delete_after=5
-            )
+            await reply_briefly(interaction, "Şu anda müzik çalmıyor.", 5)
             return
         new_volume = max(0, player.volume - 10)
-        await player.set_volume(new_volume)
-        await interaction.response.send_message(
-            f"Ses seviyesi {new_volume}% olarak ayarlandı.", delete_after=5
+        queue_player_update(player, volume=new_volume)
+        await reply_briefly(
+            interaction, f"Ses seviyesi {new_volume}% olarak ayarlandı.", 5
         )
 
 
-class SearchView(View):
+class FilterControls(ControlView):
+    def __init__(self):
+        super().__init__(timeout=None)
+        for preset, (label, _) in FILTER_PRESETS.items():
+            button = Button(
+                label=label,
+                style=(
+                    discord.ButtonStyle.grey
+                    if preset == "off"
+                    else discord.ButtonStyle.blurple
+                ),
+                custom_id=f"filter:{preset}",
+            )
+            button.callback = self.preset_callback(preset)
+            self.add_item(button)
+
+    @staticmethod
+    def preset_callback(preset: str):
+        async def callback(interaction: discord.Interaction):
+            player = get_player(interaction)
+            if not player or not player.playing:
+                await reply_briefly(interaction, "Şu anda müzik çalmıyor.", 5)
+                return
+            queue_player_update(player, preset=preset)
+            await reply_briefly(interaction, f"Efekt: {FILTER_PRESETS[preset][0]}", 5)
+
+        return callback
+
+
+control_views: dict[type[View], View] = {}
+
+
+def register_control_views():
+    """Register one persistent instance of each control panel.
+
+    Buttons carry fixed custom_ids and are routed to these instances by
+    custom_id, so panels posted before a restart keep working. Messages are
+    sent with a stopped twin of each view: discord.py only tracks unfinished
+    views per message, so the view store no longer grows with every panel.
+    """
+    for cls in (MusicControls, ExtraControls, FilterControls):
+        bot.add_view(cls())
+        template = cls()
+        # Called through View because MusicControls.stop is a button.
+        View.stop(template)
+        control_views[cls] = template
+
+
+class SearchView(ControlView):
+    throttle_class = "play"
+
     def __init__(self, search_results: list[wavelink.Playable], ctx):
         super().__init__(timeout=60)
         self.search_results = search_results
@@ -262,30 +3235,33 @@ class SearchView(View):
 
         player = get_player(interaction)
         if player:
-            await player.queue.put_wait(selected_track)
-            await interaction.response.send_message(
-                f"{selected_track.title} kuyruğa eklendi."
-            )
-            if not player.playing:
-                await player.play(player.queue.get(), volume=30)
+            async with guild_states.get(interaction.guild.id).reserve_turn():
+                await player.queue.put_wait(selected_track)
+                await interaction.response.send_message(
+                    f"{selected_track.title} kuyruğa eklendi."
+                )
+                if not player.playing:
+                    await player.play(player.queue.get(), volume=30)
+                update_panel(player)
         self.stop()
 
 
-async def send_now_playing(player: wavelink.Player, track: wavelink.Playable):
-    guild_id = player.guild.id
-
-    if guild_id in current_messages:
-        try:
-            await current_messages[guild_id].delete()
-        except Exception:
-            pass
+def build_panel_embed(player: wavelink.Player) -> discord.Embed:
+    track = player.current
+    if track is None:
+        return discord.Embed(
+            title="Queue Empty",
+            description="No more songs in queue",
+            color=discord.Color.red(),
+        )
 
     embed = discord.Embed(
         title="Now Playing",
         description=track.title,
         color=discord.Color.blue(),
     )
-    embed.add_field(name="Status", value="▶️ Playing", inline=True)
+    status = "⏸️ Paused" if player.paused else "▶️ Playing"
+    embed.add_field(name="Status", value=status, inline=True)
     embed.add_field(
         name="Queue", value=f"{player.queue.count} songs remaining", inline=True
     )
@@ -298,225 +3274,694 @@ async def send_now_playing(player: wavelink.Player, track: wavelink.Playable):
     if track.author:
         embed.add_field(name="Artist", value=track.author, inline=True)
     embed.set_footer(text="Use controls below to manage playback")
+    return embed
+
+
+def update_panel(player: wavelink.Player):
+    """Schedule a now-playing panel refresh.
+
+    Changes that arrive within PANEL_DEBOUNCE seconds of each other are folded
+    into one edit of the guild's panel message.
+    """
+    guild_id = player.guild.id
+    state_store.mark_dirty(guild_id)
+    state = guild_states.get(guild_id)
+    if state.panel_update is not None:
+        return
+    state.panel_update = asyncio.get_running_loop().call_later(
+        PANEL_DEBOUNCE, lambda: asyncio.create_task(flush_panel(guild_id))
+    )
+
+
+async def flush_panel(guild_id: int):
+    state = guild_states.peek(guild_id)
+    if state is None:
+        return
+    state.panel_update = None
+    guild = bot.get_guild(guild_id)
+    if not guild or not guild.voice_client or not state.home:
+        return
+    player = cast(wavelink.Player, guild.voice_client)
+
+    embed = build_panel_embed(player)
+    playing = player.current is not None
+    message = state.panel
+    try:
+        if message is not None:
+            kwargs = {"embed": embed}
+            if playing and not message.components:
+                kwargs["view"] = control_views[MusicControls]
+            elif not playing and message.components:
+                kwargs["view"] = None
+            try:
+                state.panel = await outbound.edit(
+                    message, priority=OutboundScheduler.CRITICAL, **kwargs
+                )
+                return
+            except discord.NotFound:
+                pass
+        state.panel = await outbound.send(
+            state.home,
+            priority=OutboundScheduler.CRITICAL,
+            key="panel",
+            embed=embed,
+            view=control_views[MusicControls] if playing else None,
+        )
+    except discord.HTTPException as e:
+        logger.error(f"Failed to update now playing panel in guild {guild_id}: {e}")
+
+
+async def clear_panel(guild_id: int):
+    state = guild_states.peek(guild_id)
+    if state is None:
+        return
+    if state.panel_update is not None:
+        state.panel_update.cancel()
+        state.panel_update = None
+    message, state.panel = state.panel, None
+    if message is not None:
+        try:
+            await outbound.delete(message)
+        except Exception:
+            pass
+
+
+@bot.event
+async def on_wavelink_node_ready(payload: wavelink.NodeReadyEventPayload):
+    if event_trace is not None:
+        event_trace.record("node", resumed=int(payload.resumed))
+    logger.info(
+        f"Wavelink node connected: {payload.node!r} | Resumed: {payload.resumed}"
+    )
+    if state_store.parked:
+        resumed = await state_store.resume_parked()
+        logger.info(f"Resumed {resumed} guild players parked after a failed failover")
+
+
+@bot.event
+async def on_wavelink_node_disconnected(payload: wavelink.NodeDisconnectedEventPayload):
+    dead = payload.node
+    node_stats.pop(dead.identifier, None)
+    if event_trace is not None:
+        event_trace.record("node_down")
+    logger.warning(f"Wavelink node disconnected: {dead!r}")
+    for voice_client in list(bot.voice_clients):
+        player = cast(wavelink.Player, voice_client)
+        if player.node.identifier == dead.identifier:
+            asyncio.create_task(failover_player(player, dead))
+
+
+@bot.event
+async def on_wavelink_track_start(payload: wavelink.TrackStartEventPayload):
+    player = payload.player
+    if player:
+        log_context(guild=player.guild.id, track=payload.track.title)
+        if event_trace is not None:
+            event_trace.record(
+                "start",
+                player.guild.id,
+                len=payload.track.length,
+                src=payload.track.source,
+            )
+        state = guild_states.get(player.guild.id)
+        ended, state.track_ended_at = state.track_ended_at, None
+        if ended is not None:
+            gap = (time.monotonic() - ended) * 1000
+            transition_stats["count"] += 1
+            transition_stats["total_ms"] += gap
+            transition_stats["max_ms"] = max(transition_stats["max_ms"], gap)
+            transition_stats["last_ms"] = gap
+            transition_gap.observe(gap / 1000)
+        update_panel(player)
+        reset_standby(player.guild.id)
+        schedule_prefetch(player)
+        remember_tracks(player.guild.id, [payload.track])
+        recommenders.observe(player.guild.id, payload.track, state.autoplay)
+        if state.autoplay:
+            schedule_autoplay(player)
+
+
+@bot.event
+async def on_wavelink_track_end(payload: wavelink.TrackEndEventPayload):
+    player = payload.player
+    if not player:
+        return
+    log_context(guild=player.guild.id, track=payload.track.title)
+    if event_trace is not None:
+        event_trace.record("end", player.guild.id, r=payload.reason)
+
+    if payload.reason == "finished" and not player.queue.is_empty:
+        guild_states.get(player.guild.id).track_ended_at = time.monotonic()
+
+    if player.queue.is_empty:
+        if payload.reason in ("finished", "stopped") and await play_autoplay(player):
+            return
+        update_panel(player)
+        reset_standby(player.guild.id)
+
+
+async def ingest_playlist(
+    player: wavelink.Player,
+    name: str,
+    tracks: list[wavelink.Playable],
+    message: discord.Message,
+    added: int,
+    previous: asyncio.Task | None,
+):
+    if previous is not None:
+        try:
+            await previous
+        except Exception:
+            pass
+
+    total = added + len(tracks)
+    last_report = time.monotonic()
+    for start in range(0, len(tracks), PLAYLIST_BATCH):
+        if not player.connected:
+            return
+        async with admission.ingest_slot():
+            async with guild_states.get(player.guild.id).reserve_turn():
+                added += await player.queue.put_wait(
+                    tracks[start : start + PLAYLIST_BATCH]
+                )
+                if not player.playing and not player.paused:
+                    await player.play(player.queue.get(), volume=30)
+        update_panel(player)
+        if time.monotonic() - last_report >= PLAYLIST_PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            try:
+                await outbound.edit(
+                    message,
+                    priority=OutboundScheduler.LOW,
+                    content=f"**{name}** playlistinden {added}/{total} şarkı kuyruğa eklendi...",
+                )
+            except discord.HTTPException:
+                pass
+        # Give the gateway and voice events a turn between batches.
+        await asyncio.sleep(0)
 
-    if hasattr(player, "home") and player.home:
-        current_messages[guild_id] = await player.home.send(
-            embed=embed, view=MusicControls()
+    try:
+        await outbound.edit(
+            message, content=f"**{name}** playlistinden {added} şarkı kuyruğa eklendi."
         )
+    except discord.HTTPException:
+        pass
 
 
-@bot.event
-async def on_wavelink_node_ready(payload: wavelink.NodeReadyEventPayload):
-    logger.info(
-        f"Wavelink node connected: {payload.node!r} | Resumed: {payload.resumed}"
+def start_ingest(
+    player: wavelink.Player,
+    name: str,
+    tracks: list[wavelink.Playable],
+    message: discord.Message,
+    added: int,
+):
+    state = guild_states.get(player.guild.id)
+    previous = state.ingest_task
+    if previous is not None and previous.done():
+        previous = None
+    state.ingest_task = asyncio.create_task(
+        ingest_playlist(player, name, tracks, message, added, previous)
     )
 
 
-@bot.event
-async def on_wavelink_track_start(payload: wavelink.TrackStartEventPayload):
-    player = payload.player
-    if player:
-        await send_now_playing(player, payload.track)
-        await reset_standby(player.guild.id)
+def is_ingesting(guild_id: int) -> bool:
+    state = guild_states.peek(guild_id)
+    return bool(state and state.ingest_task and not state.ingest_task.done())
 
 
-@bot.event
-async def on_wavelink_track_end(payload: wavelink.TrackEndEventPayload):
-    player = payload.player
-    if not player:
+def cancel_ingest(guild_id: int):
+    # Cancelling the newest job is enough; it cancels the chain it awaits.
+    state = guild_states.peek(guild_id)
+    if state is not None and state.ingest_task is not None:
+        state.ingest_task.cancel()
+        state.ingest_task = None
+
+
+async def resolve_mirror(track: wavelink.Playable) -> wavelink.Playable | None:
+    """Return the YouTube match of a mirrored track, None if there is none.
+
+    A lookup that failed (Lavalink down, a timeout) says nothing about the
+    track, so when no query matched and any of them failed, the last error
+    is raised instead of returning None.
+    """
+    queries = [f'ytsearch:"{track.isrc}"'] if track.isrc else []
+    queries.append(f"ytsearch:{track.author} - {track.title}")
+    error: Exception | None = None
+    for query in queries:
+        try:
+            results = await search_tracks(query)
+        except Exception as e:
+            logger.error(f"Mirror lookup failed for {query}: {e}")
+            error = e
+            continue
+        if results and not isinstance(results, wavelink.Playlist):
+            return results[0]
+    if error is not None:
+        raise error
+    return None
+
+
+async def prefetch(player: wavelink.Player):
+    """Resolve mirrored tracks near the head of the queue ahead of time.
+
+    A Spotify entry is swapped for the YouTube track LavaSrc would have
+    looked up at track start; entries with no match are dropped so they
+    never reach the head. Entries whose lookup failed stay put for the next
+    pass, or for LavaSrc, to retry.
+    """
+    index = 0
+    while index < min(PREFETCH_DEPTH, player.queue.count):
+        track = player.queue.peek(index)
+        if track.source not in MIRRORED_SOURCES:
+            index += 1
+            continue
+        try:
+            replacement = await resolve_mirror(track)
+        except Exception:
+            index += 1
+            continue
+        if not player.connected:
+            return
+        try:
+            position = player.queue.index(track)
+        except ValueError:
+            continue
+        if replacement is None:
+            player.queue.delete(position)
+            logger.info(f"Dropped unresolvable track from queue: {track.title}")
+        else:
+            player.queue[position] = replacement
+            index = position + 1
+    queue_drained(player)
+
+
+def schedule_prefetch(player: wavelink.Player):
+    # LavaSrc still resolves mirrors at track start; prefetch is only a
+    # head start and the first thing to go when Lavalink is struggling.
+    if PREFETCH_DEPTH <= 0 or admission.busy:
         return
+    state = guild_states.get(player.guild.id)
+    if state.prefetch_task is not None and not state.prefetch_task.done():
+        state.prefetch_task.cancel()
+    state.prefetch_task = asyncio.create_task(prefetch(player))
+
 
+def schedule_autoplay(player: wavelink.Player):
+    state = guild_states.get(player.guild.id)
+    state.autoplay_next = None
+    if state.autoplay_task is not None and not state.autoplay_task.done():
+        state.autoplay_task.cancel()
     if player.queue.is_empty:
-        guild_id = player.guild.id
-        if hasattr(player, "home") and player.home:
-            embed = discord.Embed(
-                title="Queue Empty",
-                description="No more songs in queue",
-                color=discord.Color.red(),
+        state.autoplay_task = asyncio.create_task(prepare_autoplay(player))
+
+
+def queue_drained(player: wavelink.Player):
+    """Prepare an autoplay track when a queue edit leaves nothing to play next."""
+    state = guild_states.peek(player.guild.id)
+    if (
+        state is None
+        or not state.autoplay
+        or player.current is None
+        or not player.queue.is_empty
+        or state.autoplay_next is not None
+        or (state.autoplay_task is not None and not state.autoplay_task.done())
+    ):
+        return
+    schedule_autoplay(player)
+
+
+async def prepare_autoplay(player: wavelink.Player):
+    """Pick and resolve the autoplay track while the current one still plays.
+
+    The guild's model is asked first; with too little history, the current
+    artist is searched instead. Either way the queue running dry costs no
+    lookup of its own.
+    """
+    current = player.current
+    model = recommenders.get(player.guild.id)
+    if current is None or model is None:
+        return
+    exclude = {Recommender.key(current)}
+    picks = model.recommend(1, exclude)
+    track = picks[0].to_playable() if picks else None
+    source = "model"
+    if track is None and current.author and not admission.busy:
+        source = "search"
+        try:
+            results = await search_tracks(f"ytsearch:{current.author}")
+        except Exception as e:
+            logger.error(f"Autoplay lookup failed for {current.author}: {e}")
+            results = None
+        if results and not isinstance(results, wavelink.Playlist):
+            track = next(
+                (
+                    result
+                    for result in results
+                    if Recommender.key(result) not in exclude
+                    and not model.played_recently(Recommender.key(result))
+                ),
+                None,
             )
-            if guild_id in current_messages:
-                try:
-                    await current_messages[guild_id].delete()
-                except Exception:
-                    pass
-            current_messages[guild_id] = await player.home.send(embed=embed)
-        await reset_standby(guild_id)
+    if track is not None and track.source in MIRRORED_SOURCES:
+        try:
+            track = await resolve_mirror(track)
+        except Exception:
+            track = None
+    if track is not None:
+        guild_states.get(player.guild.id).autoplay_next = track
+        autoplay_stats[source] += 1
+    else:
+        autoplay_stats["miss"] += 1
+
+
+async def play_autoplay(player: wavelink.Player) -> bool:
+    state = guild_states.peek(player.guild.id)
+    if (
+        state is None
+        or not state.autoplay
+        or state.autoplay_next is None
+        or player.queue.mode is not wavelink.QueueMode.normal
+    ):
+        return False
+    track, state.autoplay_next = state.autoplay_next, None
+    try:
+        await player.play(track)
+    except Exception as e:
+        logger.error(f"Autoplay failed in guild {player.guild.id}: {e}")
+        return False
+    return True
 
 
 async def resolve_spotify(url_or_query: str) -> list[wavelink.Playable]:
     """Search via wavelink which handles Spotify through LavaSrc plugin."""
-    tracks: wavelink.Search = await wavelink.Playable.search(url_or_query)
+    tracks: wavelink.Search = await search_tracks(url_or_query)
     if isinstance(tracks, wavelink.Playlist):
         return list(tracks.tracks)
     return list(tracks) if tracks else []
 
 
-@bot.command()
-async def play(ctx, *, url_or_query: str):
-    try:
-        if not ctx.author.voice or not ctx.author.voice.channel:
-            await ctx.send("Önce bir ses kanalına gir.")
-            return
+async def apply_request(ctx, tracks: wavelink.Search, mode: str):
+    player: wavelink.Player
+    if not ctx.voice_client:
+        player = await ctx.author.voice.channel.connect(cls=placed_player())
+    else:
+        player = cast(wavelink.Player, ctx.voice_client)
 
-        player: wavelink.Player
-        if not ctx.voice_client:
-            player = await ctx.author.voice.channel.connect(cls=wavelink.Player)
+    state = guild_states.get(ctx.guild.id)
+    if state.home is None:
+        state.home = ctx.channel
+    player.queue.set_shuffle(state.shuffled)
+
+    if isinstance(tracks, wavelink.Playlist):
+        # Queue the head right away and let the rest trickle in, so a
+        # long playlist starts playing without waiting on the whole list.
+        # If an earlier playlist is still loading, this one goes after it.
+        items = list(tracks.tracks)
+        head = [] if is_ingesting(ctx.guild.id) else items[:PLAYLIST_FIRST_BATCH]
+        added = await player.queue.put_wait(head) if head else 0
+        rest = items[len(head) :]
+        if head:
+            content = f"**{tracks.name}** playlistinden {added} şarkı kuyruğa eklendi."
         else:
-            player = cast(wavelink.Player, ctx.voice_client)
+            content = (
+                f"**{tracks.name}** playlisti yükleniyor, önceki playlist "
+                "bitince kuyruğa eklenecek."
+            )
+        message = await post(ctx, content)
+        if rest:
+            start_ingest(player, tracks.name, rest, message, added)
+    elif mode == "next":
+        track = tracks[0]
+        player.queue.put_at(0, track)
+        await post(ctx, f"**{track.title}** kuyruğun başına eklendi.")
+    elif mode == "now":
+        track = tracks[0]
+        await player.play(track, volume=30)
+        await post(ctx, f"**{track.title}** şimdi çalınıyor.")
+    else:
+        track = tracks[0]
+        await player.queue.put_wait(track)
+        await post(ctx, f"**{track.title}** kuyruğa eklendi.")
 
-        if not hasattr(player, "home"):
-            player.home = ctx.channel
+    # A playlist queued behind one still loading may have added nothing yet;
+    # its ingest starts playback once tracks arrive.
+    if not player.playing and not player.queue.is_empty:
+        await player.play(player.queue.get(), volume=30)
 
-        tracks: wavelink.Search = await wavelink.Playable.search(url_or_query)
-        if not tracks:
-            await ctx.send("Şarkı bulunamadı.")
-            return
+    if mode != "next":
+        # Nice to have; merged with a pending copy and dropped when busy.
+        await post(
+            ctx,
+            "Extra controls:",
+            priority=OutboundScheduler.LOW,
+            key="extra-controls",
+            view=control_views[ExtraControls],
+        )
+    reset_standby(ctx.guild.id)
+    update_panel(player)
+    schedule_prefetch(player)
 
-        if isinstance(tracks, wavelink.Playlist):
-            added = await player.queue.put_wait(tracks)
-            await ctx.send(
-                f"**{tracks.name}** playlistinden {added} şarkı kuyruğa eklendi."
-            )
-        else:
-            track = tracks[0]
-            await player.queue.put_wait(track)
-            await ctx.send(f"**{track.title}** kuyruğa eklendi.")
 
-        if not player.playing:
-            await player.play(player.queue.get(), volume=30)
+async def enqueue_request(ctx, query: str, mode: str):
+    """Shared entry point of !play ("queue"), !playnext and !playnow."""
+    if not ctx.author.voice or not ctx.author.voice.channel:
+        await post(ctx, "Önce bir ses kanalına gir.")
+        return
 
-        await ctx.send("Extra controls:", view=ExtraControls())
-        await reset_standby(ctx.guild.id)
+    # Slash commands have to be acknowledged within 3 seconds; a no-op for !play.
+    await ctx.defer()
+    if ctx.voice_client:
+        await resolve_request(ctx, query, mode)
+        return
 
-    except Exception as e:
-        logger.error(f"Error in play command: {e}")
-        await ctx.send(f"Bir hata oluştu: {str(e)}")
+    async with admission.session(
+        lambda: post(
+            ctx, "Müzik sunucusu şu anda çok yoğun, yer açılınca isteğin başlayacak..."
+        )
+    ) as admitted:
+        if admitted:
+            await resolve_request(ctx, query, mode)
+            return
+    await post(
+        ctx,
+        "Üzgünüm, müzik sunucusu şu anda tam kapasitede. "
+        "Lütfen birkaç dakika sonra tekrar dene.",
+    )
 
 
-@bot.command()
-async def playnext(ctx, *, url_or_query: str):
+async def resolve_request(ctx, query: str, mode: str):
+    """Look up a query and apply it to the guild's player.
+
+    The lookup starts straight away and may overlap with other commands;
+    connecting, queueing and starting playback wait for the guild's turn.
+    A newer !playnow cancels the lookup of an older one still in flight.
+    """
+    state = guild_states.get(ctx.guild.id)
+    lookup = asyncio.create_task(asyncio.wait_for(search_tracks(query), SEARCH_TIMEOUT))
+    if mode == "now":
+        if state.pending_playnow is not None:
+            state.pending_playnow.cancel()
+        state.pending_playnow = lookup
+    turn = state.reserve_turn()
     try:
-        if not ctx.author.voice or not ctx.author.voice.channel:
-            await ctx.send("Önce bir ses kanalına gir.")
+        try:
+            tracks: wavelink.Search = await lookup
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+            await post(
+                ctx, "Daha yeni bir !playnow geldiği için bu arama iptal edildi."
+            )
             return
+        except asyncio.TimeoutError:
+            await post(ctx, "Arama zaman aşımına uğradı, tekrar dene.")
+            return
+        finally:
+            if state.pending_playnow is lookup:
+                state.pending_playnow = None
 
-        player: wavelink.Player
-        if not ctx.voice_client:
-            player = await ctx.author.voice.channel.connect(cls=wavelink.Player)
-        else:
-            player = cast(wavelink.Player, ctx.voice_client)
-
-        if not hasattr(player, "home"):
-            player.home = ctx.channel
-
-        tracks: wavelink.Search = await wavelink.Playable.search(url_or_query)
         if not tracks:
-            await ctx.send("Şarkı bulunamadı.")
+            await post(ctx, "Şarkı bulunamadı.")
             return
-
-        if isinstance(tracks, wavelink.Playlist):
-            await ctx.send("Bu komut sadece tekli şarkılar için kullanılabilir.")
+        if mode != "queue" and isinstance(tracks, wavelink.Playlist):
+            await post(ctx, "Bu komut sadece tekli şarkılar için kullanılabilir.")
             return
 
-        track = tracks[0]
-        player.queue.put_at(0, track)
-        await ctx.send(f"**{track.title}** kuyruğun başına eklendi.")
+        await turn.wait()
+        try:
+            await asyncio.wait_for(apply_request(ctx, tracks, mode), COMMAND_TIMEOUT)
+        except asyncio.TimeoutError:
+            await post(ctx, "İşlem zaman aşımına uğradı, tekrar dene.")
+    finally:
+        turn.release()
 
-        if not player.playing:
-            await player.play(player.queue.get(), volume=30)
 
-        await reset_standby(ctx.guild.id)
+@bot.hybrid_command()
+@app_commands.describe(url_or_query="Şarkı adı veya URL")
+@app_commands.autocomplete(url_or_query=track_autocomplete)
+async def play(ctx, *, url_or_query: str):
+    try:
+        await enqueue_request(ctx, url_or_query, "queue")
+    except Exception as e:
+        logger.error(f"Error in play command: {e}")
+        await post(ctx, f"Bir hata oluştu: {str(e)}")
+
 
+@bot.hybrid_command()
+@app_commands.describe(url_or_query="Şarkı adı veya URL")
+@app_commands.autocomplete(url_or_query=track_autocomplete)
+async def playnext(ctx, *, url_or_query: str):
+    try:
+        await enqueue_request(ctx, url_or_query, "next")
     except Exception as e:
         logger.error(f"Error in playnext command: {e}")
-        await ctx.send(f"Bir hata oluştu: {str(e)}")
+        await post(ctx, f"Bir hata oluştu: {str(e)}")
 
 
-@bot.command()
+@bot.hybrid_command()
+@app_commands.describe(url_or_query="Şarkı adı veya URL")
+@app_commands.autocomplete(url_or_query=track_autocomplete)
 async def playnow(ctx, *, url_or_query: str):
     try:
-        if not ctx.author.voice or not ctx.author.voice.channel:
-            await ctx.send("Önce bir ses kanalına gir.")
-            return
-
-        player: wavelink.Player
-        if not ctx.voice_client:
-            player = await ctx.author.voice.channel.connect(cls=wavelink.Player)
-        else:
-            player = cast(wavelink.Player, ctx.voice_client)
-
-        if not hasattr(player, "home"):
-            player.home = ctx.channel
+        await enqueue_request(ctx, url_or_query, "now")
+    except Exception as e:
+        logger.error(f"Error in playnow command: {e}")
+        await post(ctx, f"Bir hata oluştu: {str(e)}")
 
-        tracks: wavelink.Search = await wavelink.Playable.search(url_or_query)
-        if not tracks:
-            await ctx.send("Şarkı bulunamadı.")
-            return
 
-        if isinstance(tracks, wavelink.Playlist):
-            await ctx.send("Bu komut sadece tekli şarkılar için kullanılabilir.")
-            return
+@bot.hybrid_command(name="filter")
+@app_commands.describe(preset="Uygulanacak efekt")
+@app_commands.choices(
+    preset=[
+        app_commands.Choice(name=label, value=preset)
+        for preset, (label, _) in FILTER_PRESETS.items()
+    ]
+)
+async def filter_command(ctx, preset: str | None = None):
+    if preset is None:
+        await post(ctx, "Ses efektleri:", view=control_views[FilterControls])
+        return
+    preset = preset.lower()
+    if preset not in FILTER_PRESETS:
+        await post(ctx, f"Bilinmeyen efekt. Seçenekler: {', '.join(FILTER_PRESETS)}")
+        return
+    player = get_player(ctx)
+    if not player or not player.playing:
+        await post(ctx, "Şu anda müzik çalmıyor.")
+        return
+    queue_player_update(player, preset=preset)
+    await post(ctx, f"Efekt: {FILTER_PRESETS[preset][0]}")
 
-        track = tracks[0]
-        await player.play(track, volume=30)
-        await ctx.send(f"**{track.title}** şimdi çalınıyor.")
-        await ctx.send("Extra controls:", view=ExtraControls())
-        await reset_standby(ctx.guild.id)
 
-    except Exception as e:
-        logger.error(f"Error in playnow command: {e}")
-        await ctx.send(f"Bir hata oluştu: {str(e)}")
+@bot.hybrid_command()
+async def autoplay(ctx):
+    state = guild_states.get(ctx.guild.id)
+    state.autoplay = not state.autoplay
+    player = get_player(ctx)
+    if state.autoplay:
+        recommenders.get(ctx.guild.id, create=True)
+        if player and player.current:
+            schedule_autoplay(player)
+    else:
+        state.autoplay_next = None
+    if player:
+        state_store.mark_dirty(ctx.guild.id)
+    await post(ctx, f"Otomatik çalma {'açıldı' if state.autoplay else 'kapatıldı'}.")
 
 
 @bot.command()
 async def controls(ctx):
-    await ctx.send("Müzik kontrolleri:", view=MusicControls())
-    await ctx.send("Ekstra kontroller:", view=ExtraControls())
+    await post(ctx, "Müzik kontrolleri:", view=control_views[MusicControls])
+    await post(ctx, "Ekstra kontroller:", view=control_views[ExtraControls])
+
+
+def parse_range(text: str) -> tuple[int, int] | None:
+    first, sep, last = text.partition("-")
+    try:
+        start = int(first)
+        end = int(last) if sep else start
+    except ValueError:
+        return None
+    if start < 1 or end < start:
+        return None
+    return start, end
 
 
 @bot.command()
-async def move(ctx, from_pos: int, to_pos: int):
+async def move(ctx, positions: str, to_pos: int):
     player = get_player(ctx)
     if not player or player.queue.is_empty:
-        await ctx.send("Kuyruk boş.")
+        await post(ctx, "Kuyruk boş.")
         return
-    if (
-        from_pos < 1
-        or to_pos < 1
-        or from_pos > player.queue.count
-        or to_pos > player.queue.count
-    ):
-        await ctx.send("Geçersiz sıra numarası.")
+    span = parse_range(positions)
+    if span is None or span[1] > player.queue.count:
+        await post(ctx, "Geçersiz sıra numarası.")
+        return
+    start, end = span
+    count = end - start + 1
+    if to_pos < 1 or to_pos > player.queue.count - count + 1:
+        await post(ctx, "Geçersiz sıra numarası.")
         return
-    track = player.queue.peek(from_pos - 1)
-    player.queue.delete(from_pos - 1)
-    player.queue.put_at(to_pos - 1, track)
-    await ctx.send(f"{track.title} {to_pos}. sıraya taşındı.")
+    track = player.queue.peek(start - 1)
+    player.queue.move(start - 1, end, to_pos - 1)
+    update_panel(player)
+    schedule_prefetch(player)
+    if count == 1:
+        await post(ctx, f"{track.title} {to_pos}. sıraya taşındı.")
+    else:
+        await post(ctx, f"{count} şarkı {to_pos}. sıraya taşındı.")
 
 
 @bot.command()
-async def remove(ctx, pos: int):
+async def remove(ctx, positions: str):
     player = get_player(ctx)
     if not player or player.queue.is_empty:
-        await ctx.send("Kuyruk boş.")
+        await post(ctx, "Kuyruk boş.")
         return
-    if pos < 1 or pos > player.queue.count:
-        await ctx.send("Geçersiz sıra numarası.")
+    span = parse_range(positions)
+    if span is None or span[1] > player.queue.count:
+        await post(ctx, "Geçersiz sıra numarası.")
         return
-    track = player.queue.peek(pos - 1)
-    player.queue.delete(pos - 1)
-    await ctx.send(f"{track.title} kuyruktan silindi.")
+    start, end = span
+    track = player.queue.peek(start - 1)
+    player.queue.delete_range(start - 1, end)
+    update_panel(player)
+    schedule_prefetch(player)
+    queue_drained(player)
+    if start == end:
+        await post(ctx, f"{track.title} kuyruktan silindi.")
+    else:
+        await post(ctx, f"{end - start + 1} şarkı kuyruktan silindi.")
 
 
 @bot.command()
+@commands.has_permissions(manage_guild=True)
+async def idle(ctx, minutes: int | None = None):
+    if minutes is not None and minutes < 1:
+        await post(ctx, "Süre en az 1 dakika olmalı.")
+        return
+    idle_scheduler.set_timeout(ctx.guild.id, minutes * 60 if minutes else None)
+    if ctx.voice_client:
+        reset_standby(ctx.guild.id)
+    current = idle_scheduler.timeout_for(ctx.guild.id) // 60
+    await post(ctx, f"Hareketsizlik süresi {current} dakika olarak ayarlandı.")
+
+
+@bot.hybrid_command()
+@app_commands.describe(query="Şarkı adı")
+@app_commands.autocomplete(query=track_autocomplete)
 async def search(ctx, *, query: str):
     try:
-        tracks: wavelink.Search = await wavelink.Playable.search(query)
+        await ctx.defer()
+        tracks: wavelink.Search = await asyncio.wait_for(
+            search_tracks(query), SEARCH_TIMEOUT
+        )
         if not tracks or isinstance(tracks, wavelink.Playlist):
-            await ctx.send("Arama sonucunda şarkı bulunamadı.")
+            await post(ctx, "Arama sonucunda şarkı bulunamadı.")
             return
 
         results = list(tracks[:5])
+        remember_tracks(ctx.guild.id, results)
         view = SearchView(results, ctx)
         embed = discord.Embed(
             title=f"'{query}' için Arama Sonuçları",
@@ -530,11 +3975,13 @@ async def search(ctx, *, query: str):
                 value=f"Süre: {duration} | {track.author}",
                 inline=False,
             )
-        await ctx.send(embed=embed, view=view)
+        await post(ctx, embed=embed, view=view)
 
+    except asyncio.TimeoutError:
+        await post(ctx, "Arama zaman aşımına uğradı, tekrar dene.")
     except Exception as e:
         logger.error(f"Error in search command: {e}")
-        await ctx.send(f"Bir hata oluştu: {str(e)}")
+        await post(ctx, f"Bir hata oluştu: {str(e)}")
 
 
 @bot.command()
@@ -569,33 +4016,277 @@ async def help(ctx):
         value="Müzik kontrol butonlarını gösterir.\n**Örnek:**\n- `!controls`",
         inline=False,
     )
+    embed.add_field(
+        name="!filter [efekt]",
+        value="Ses efekti uygular; efekt verilmezse efekt butonlarını gösterir.\n**Örnek:**\n- `!filter nightcore`\n- `!filter bassboost`\n- `!filter off`",
+        inline=False,
+    )
+    embed.add_field(
+        name="!autoplay",
+        value="Kuyruk bittiğinde sunucunun dinleme geçmişine göre benzer şarkıları otomatik çalmayı açar veya kapatır.\n**Örnek:**\n- `!autoplay`",
+        inline=False,
+    )
     embed.add_field(
         name="!move <başlangıç sırası> <hedef sıra>",
-        value="Kuyruktaki bir şarkıyı başka bir sıraya taşır.\n**Örnek:**\n- `!move 3 1`",
+        value="Kuyruktaki bir şarkıyı veya şarkı aralığını başka bir sıraya taşır.\n**Örnek:**\n- `!move 3 1`\n- `!move 5-8 1`",
         inline=False,
     )
     embed.add_field(
         name="!remove <sıra numarası>",
-        value="Kuyruktaki belirli bir şarkıyı siler.\n**Örnek:**\n- `!remove 2`",
+        value="Kuyruktaki belirli bir şarkıyı veya şarkı aralığını siler.\n**Örnek:**\n- `!remove 2`\n- `!remove 2-6`",
         inline=False,
     )
-    embed.set_footer(text="Not: Botu kullanmadan önce bir ses kanalına girmelisiniz.")
-    await ctx.send(embed=embed)
+    embed.add_field(
+        name="!idle [dakika]",
+        value="Botun hareketsiz kaldığında kanaldan ayrılma süresini ayarlar. Süre verilmezse varsayılana döner.\n**Örnek:**\n- `!idle 30`",
+        inline=False,
+    )
+    embed.set_footer(
+        text="Not: Botu kullanmadan önce bir ses kanalına girmelisiniz. "
+        "/play, /playnext, /playnow ve /search komutları da otomatik tamamlama ile kullanılabilir."
+    )
+    await post(ctx, embed=embed)
+
+
+@bot.event
+async def on_voice_state_update(member, before, after):
+    if member.id == bot.user.id and before.channel and after.channel is None:
+        guild_states.evict(member.guild.id)
+        if member.guild.id not in state_store.parked:
+            state_store.forget(member.guild.id)
+
+
+@bot.event
+async def on_guild_available(guild):
+    if state_restored and await state_store.restore_unavailable(guild.id):
+        logger.info(f"Restored guild {guild.id} after it became available")
+
+
+@bot.event
+async def on_guild_remove(guild):
+    guild_states.evict(guild.id)
+    state_store.parked.discard(guild.id)
+    state_store._unavailable.pop(guild.id, None)
+    state_store.forget(guild.id)
+    idle_scheduler.cancel(guild.id)
+    idle_scheduler.set_timeout(guild.id, None)
 
 
 @bot.event
 async def on_ready():
+    global state_restored
     logger.info(f"Bot {bot.user} olarak bağlandı!")
+    if not state_restored:
+        state_restored = True
+        restored, elapsed = await state_store.restore()
+        restore_stats.update(guilds=restored, seconds=elapsed)
+        logger.info(f"Restored {restored} guild players in {elapsed:.2f}s")
+
+
+class EventTrace:
+    """Opt-in NDJSON recording of incoming events for benchmarks/replay.py.
+
+    Guild and user ids are replaced by small per-trace numbers and free text
+    by salted hashes, so a trace carries the shape of the traffic but not
+    who sent it or what they searched for. Lines are buffered on the loop
+    and appended from a worker thread.
+    """
+
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = interval
+        self.started = time.monotonic()
+        self.events = 0
+        self._salt = os.urandom(16)
+        self._ids: dict[int, int] = {}
+        self._buffer: list[str] = [
+            json.dumps({"v": 1, "started": time.time()}, separators=(",", ":"))
+        ]
+
+    def _anon(self, snowflake: int) -> int:
+        return self._ids.setdefault(snowflake, len(self._ids) + 1)
+
+    def token(self, text: str) -> str:
+        if re.fullmatch(r"[\d\-]+", text):
+            return text
+        if _PLAYLIST_QUERY.search(text):
+            kind = "pl"
+        elif text.startswith(("http://", "https://")):
+            kind = "url"
+        else:
+            kind = "q"
+        digest = hashlib.blake2b(text.encode(), key=self._salt, digest_size=5)
+        return f"{kind}:{digest.hexdigest()}"
+
+    def args(self, name: str, text: str) -> list[str]:
+        # Queries are one free-text argument; everything else splits on spaces.
+        if not text:
+            return []
+        if name in THROTTLE_CLASSES:
+            return [self.token(text)]
+        return [self.token(part) for part in text.split()]
+
+    def record(self, event: str, guild_id=None, user_id=None, **fields):
+        entry = {"t": round(time.monotonic() - self.started, 4), "e": event}
+        if guild_id is not None:
+            entry["g"] = self._anon(guild_id)
+        if user_id is not None:
+            entry["u"] = self._anon(user_id)
+        entry.update(fields)
+        self._buffer.append(json.dumps(entry, separators=(",", ":")))
+        self.events += 1
+
+    def _append(self, lines: list[str]):
+        with open(self.path, "a", encoding="utf-8") as trace_file:
+            trace_file.write("\n".join(lines) + "\n")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._buffer:
+                lines, self._buffer = self._buffer, []
+                try:
+                    await asyncio.to_thread(self._append, lines)
+                except OSError as e:
+                    logger.error(f"Failed to write event trace: {e}")
+
+    def close(self):
+        if self._buffer:
+            self._append(self._buffer)
+            self._buffer = []
+
+
+event_trace = EventTrace(TRACE_PATH, TRACE_FLUSH_INTERVAL) if TRACE_PATH else None
+if event_trace is not None:
+    atexit.register(event_trace.close)
+
+
+def option_text(interaction: discord.Interaction) -> str:
+    options = (interaction.data or {}).get("options", [])
+    return " ".join(str(option.get("value", "")) for option in options)
+
+
+@bot.listen("on_command")
+async def trace_command(ctx: commands.Context):
+    # Dispatched by bot.invoke for prefix and hybrid slash commands alike,
+    # before checks, so throttled invocations are in the trace too.
+    if event_trace is None or not ctx.guild or ctx.command is None:
+        return
+    name = ctx.command.name
+    if ctx.interaction is not None:
+        text = option_text(ctx.interaction)
+    else:
+        skip = len(ctx.prefix or "") + len(ctx.invoked_with or "")
+        text = ctx.message.content[skip:].strip()
+    entry = {"n": name, "a": event_trace.args(name, text)}
+    if ctx.interaction is not None:
+        entry["slash"] = 1
+    event_trace.record("cmd", ctx.guild.id, ctx.author.id, **entry)
+
+
+@bot.listen("on_interaction")
+async def trace_autocomplete(interaction: discord.Interaction):
+    # Commands are traced by trace_command and buttons by ControlView.
+    if event_trace is None or not interaction.guild_id:
+        return
+    if interaction.type is discord.InteractionType.autocomplete:
+        text = option_text(interaction)
+        event_trace.record(
+            "ac",
+            interaction.guild_id,
+            interaction.user.id,
+            n=(interaction.data or {}).get("name"),
+            a=[event_trace.token(text)] if text else [],
+        )
+
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, Throttled):
+        await post(
+            ctx, throttle_message(error.retry_after), priority=OutboundScheduler.LOW
+        )
+        return
+    await type(bot).on_command_error(bot, ctx, error)
+
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started_at = time.perf_counter()
+    log_context(guild=ctx.guild.id if ctx.guild else None, command=ctx.command.name)
+
+
+@bot.after_invoke
+async def stop_command_timer(ctx):
+    child = command_metrics.get(ctx.command.qualified_name)
+    if child is not None:
+        child.observe(time.perf_counter() - ctx.started_at)
+
+
+def instrument_http():
+    request = bot.http.request
+
+    async def timed_request(route, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await request(route, *args, **kwargs)
+        finally:
+            child = rest_children.get((route.method, route.path))
+            if child is None:
+                child = rest_children[(route.method, route.path)] = rest_latency.labels(
+                    route.method, route.path
+                )
+            child.observe(time.perf_counter() - start)
+
+    rest_children: dict[tuple[str, str], HistogramChild] = {}
+    bot.http.request = timed_request
+
+
+def command_hash() -> str:
+    payloads = [command.to_dict(bot.tree) for command in bot.tree.get_commands()]
+    payload = json.dumps(payloads, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def sync_commands(force: bool = False):
+    digest = command_hash()
+    try:
+        with open(COMMAND_HASH_PATH, encoding="utf-8") as hash_file:
+            synced_digest = hash_file.read().strip()
+    except OSError:
+        synced_digest = None
+    if digest == synced_digest and not force:
+        logger.info("Slash commands unchanged since the last sync, skipping")
+        return
+    try:
+        synced = await bot.tree.sync()
+    except discord.DiscordException as e:
+        logger.error(f"Failed to sync slash commands: {e}")
+        return
+    logger.info(f"Synced {len(synced)} slash commands")
+    try:
+        with open(COMMAND_HASH_PATH, "w", encoding="utf-8") as hash_file:
+            hash_file.write(digest)
+    except OSError as e:
+        logger.error(f"Failed to record slash command sync: {e}")
 
 
 async def setup_hook():
-    nodes = [
-        wavelink.Node(
-            uri=LAVALINK_URI,
-            password=LAVALINK_PASSWORD,
+    for command in bot.commands:
+        command_metrics[command.qualified_name] = command_latency.labels(
+            command.qualified_name
         )
-    ]
-    await wavelink.Pool.connect(nodes=nodes, client=bot, cache_capacity=100)
+    instrument_http()
+    register_control_views()
+    if SYNC_COMMANDS != "0":
+        await sync_commands(force=SYNC_COMMANDS == "force")
+    await wavelink.Pool.connect(nodes=build_nodes(), client=bot, cache_capacity=100)
+    asyncio.create_task(poll_node_stats())
+    idle_scheduler.start()
+    asyncio.create_task(state_store.run())
+    asyncio.create_task(guild_states.run())
+    if event_trace is not None:
+        asyncio.create_task(event_trace.run())
 
 
 bot.setup_hook = setup_hook
@@ -605,33 +4296,348 @@ async def health_handler(request):
     return web.Response(text="OK")
 
 
+async def cache_handler(request):
+    return web.json_response(search_cache.stats())
+
+
+async def transitions_handler(request):
+    count = transition_stats["count"]
+    return web.json_response(
+        {
+            "prefetch_depth": PREFETCH_DEPTH,
+            "count": count,
+            "avg_ms": transition_stats["total_ms"] / count if count else 0.0,
+            "max_ms": transition_stats["max_ms"],
+            "last_ms": transition_stats["last_ms"],
+        }
+    )
+
+
+async def metrics_handler(request):
+    out: list[str] = []
+    for histogram in (
+        command_latency,
+        search_latency,
+        transition_gap,
+        rest_latency,
+        loop_lag,
+    ):
+        histogram.render(out)
+
+    players = [cast(wavelink.Player, vc) for vc in bot.voice_clients]
+    queue_lengths = [player.queue.count for player in players]
+    render_gauge(
+        out, "bot_players", "Connected voice players.", (), [((), len(players))]
+    )
+    render_gauge(
+        out,
+        "bot_players_playing",
+        "Players currently playing.",
+        (),
+        [((), sum(1 for player in players if player.playing))],
+    )
+    render_gauge(
+        out,
+        "bot_queue_tracks",
+        "Queued tracks across all players.",
+        (),
+        [((), sum(queue_lengths))],
+    )
+    render_gauge(
+        out,
+        "bot_queue_tracks_max",
+        "Longest queue of any player.",
+        (),
+        [((), max(queue_lengths, default=0))],
+    )
+    render_gauge(
+        out,
+        "bot_standby_timers",
+        "Pending idle-disconnect timers.",
+        (),
+        [((), len(idle_scheduler))],
+    )
+    render_gauge(
+        out,
+        "bot_guild_states",
+        "Guild state records held in memory.",
+        (),
+        [((), len(guild_states))],
+    )
+    render_gauge(
+        out,
+        "bot_throttled_total",
+        "Commands and button presses refused by the token buckets.",
+        ("scope", "class"),
+        [(key, count) for key, count in throttle.throttled.items()],
+        kind="counter",
+    )
+    render_gauge(
+        out,
+        "bot_throttle_buckets",
+        "Token buckets held in memory.",
+        (),
+        [((), len(throttle))],
+    )
+    render_gauge(
+        out,
+        "bot_outbound_queue_depth",
+        "Channel sends/edits waiting in the outbound scheduler.",
+        ("priority",),
+        [
+            ((("critical", "normal", "low")[priority],), count)
+            for priority, count in outbound.depth().items()
+        ],
+    )
+    render_gauge(
+        out,
+        "bot_outbound_ops_total",
+        "Outbound ops merged into a pending one, shed, or deleted in bulk.",
+        ("outcome",),
+        [
+            (("merged",), outbound.merged),
+            (("shed",), outbound.shed),
+            (("bulk_delete_requests",), outbound.bulk_deletes),
+            (("deleted",), outbound.deleted),
+        ],
+        kind="counter",
+    )
+    render_gauge(
+        out,
+        "bot_log_queue_depth",
+        "Log records waiting for the writer thread.",
+        (),
+        [((), log_handler.queue.qsize())],
+    )
+    render_gauge(
+        out,
+        "bot_log_records_dropped_total",
+        "Log records dropped because the queue was full.",
+        (),
+        [((), log_handler.dropped)],
+        kind="counter",
+    )
+    render_gauge(
+        out,
+        "bot_log_records_suppressed_total",
+        "Log records left out by per-call-site sampling.",
+        (),
+        [((), log_sampler.suppressed)],
+        kind="counter",
+    )
+    render_gauge(
+        out,
+        "bot_recommender_models",
+        "Per-guild autoplay models held in memory.",
+        (),
+        [((), len(recommenders))],
+    )
+    render_gauge(
+        out,
+        "bot_autoplay_picks_total",
+        "Autoplay tracks prepared, by where they came from.",
+        ("source",),
+        [((source,), count) for source, count in autoplay_stats.items()],
+        kind="counter",
+    )
+    render_gauge(
+        out,
+        "bot_search_cache_entries",
+        "Entries in the in-memory search cache.",
+        (),
+        [((), search_cache.stats()["memory_entries"])],
+    )
+    render_gauge(
+        out,
+        "bot_search_lookups_waiting",
+        "Lavalink lookups queued behind MAX_LOOKUPS.",
+        (),
+        [((), search_cache.lookups_waiting)],
+    )
+
+    nodes = list(wavelink.Pool.nodes.values())
+    render_gauge(
+        out,
+        "lavalink_node_up",
+        "Whether the node is connected.",
+        ("node",),
+        [
+            ((n.identifier,), int(n.status is wavelink.NodeStatus.CONNECTED))
+            for n in nodes
+        ],
+    )
+    render_gauge(
+        out,
+        "lavalink_node_load_ratio",
+        "Worst of the node's admission signals against its limit.",
+        ("node",),
+        [((n.identifier,), admission.node_load(n)) for n in nodes],
+    )
+    render_gauge(
+        out,
+        "bot_admission_level",
+        "Admission level: 0 ok, 1 busy, 2 full.",
+        (),
+        [((), admission.level())],
+    )
+    render_gauge(
+        out,
+        "bot_admission_limit",
+        "Configured admission thresholds.",
+        ("signal",),
+        [((name,), limit) for name, limit in admission.limits.items()]
+        + [(("busy_ratio",), admission.busy_ratio)],
+    )
+    render_gauge(
+        out,
+        "bot_admission_waiting",
+        "New sessions waiting for Lavalink capacity.",
+        (),
+        [((), admission.waiting)],
+    )
+    render_gauge(
+        out,
+        "bot_admission_sessions_total",
+        "New session requests by admission outcome.",
+        ("outcome",),
+        [((outcome,), count) for outcome, count in admission.outcomes.items()],
+        kind="counter",
+    )
+    render_gauge(
+        out,
+        "lavalink_node_penalty",
+        "Placement penalty used to pick nodes.",
+        ("node",),
+        [((n.identifier,), node_penalty(n)) for n in nodes],
+    )
+    stats = list(node_stats.items())
+    for name, help_text, value in (
+        ("lavalink_node_players", "Players reported by the node.", lambda s: s.players),
+        (
+            "lavalink_node_playing",
+            "Playing players reported by the node.",
+            lambda s: s.playing,
+        ),
+        (
+            "lavalink_node_cpu_system_load",
+            "System CPU load.",
+            lambda s: s.cpu.system_load,
+        ),
+        (
+            "lavalink_node_cpu_lavalink_load",
+            "Lavalink CPU load.",
+            lambda s: s.cpu.lavalink_load,
+        ),
+        (
+            "lavalink_node_memory_used_bytes",
+            "JVM memory used.",
+            lambda s: s.memory.used,
+        ),
+        (
+            "lavalink_node_frame_deficit",
+            "Frames missing per minute.",
+            lambda s: s.frames.deficit if s.frames else 0,
+        ),
+        (
+            "lavalink_node_frames_nulled",
+            "Frames nulled per minute.",
+            lambda s: s.frames.nulled if s.frames else 0,
+        ),
+    ):
+        render_gauge(
+            out, name, help_text, ("node",), [((i,), value(s)) for i, s in stats]
+        )
+
+    return web.Response(
+        text="\n".join(out) + "\n", content_type="text/plain", charset="utf-8"
+    )
+
+
+async def profile_handler(request):
+    if not DEBUG_TOKEN or request.query.get("token") != DEBUG_TOKEN:
+        raise web.HTTPNotFound()
+    try:
+        seconds = float(request.query.get("seconds", 10))
+    except ValueError:
+        raise web.HTTPBadRequest(text="seconds must be a number")
+    seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+    profile = await asyncio.to_thread(sample_profile, loop_monitor.thread_id, seconds)
+    return web.Response(text=profile, content_type="text/plain")
+
+
+async def shards_handler(request):
+    if isinstance(bot, commands.AutoShardedBot):
+        shards = {
+            shard_id: {
+                "latency": None if shard.latency == float("inf") else shard.latency,
+                "closed": shard.is_closed(),
+                "guilds": 0,
+            }
+            for shard_id, shard in bot.shards.items()
+        }
+        for guild in bot.guilds:
+            if guild.shard_id in shards:
+                shards[guild.shard_id]["guilds"] += 1
+    else:
+        shards = {
+            0: {
+                "latency": None if bot.latency == float("inf") else bot.latency,
+                "closed": bot.is_closed(),
+                "guilds": len(bot.guilds),
+            }
+        }
+    return web.json_response(
+        {
+            "cluster": CLUSTER_ID,
+            "shard_count": bot.shard_count or 1,
+            "ready": bot.is_ready(),
+            "players": len(bot.voice_clients),
+            "standby_timers": len(idle_scheduler),
+            "restore": restore_stats,
+            "guild_states": guild_states.stats(),
+            "loop": {"max_lag": loop_monitor.max_lag, "stalls": loop_monitor.stalls},
+            "admission": admission.stats(),
+            "shards": shards,
+        }
+    )
+
+
 async def start_health_server():
     app = web.Application()
     app.router.add_get("/", health_handler)
+    app.router.add_get("/cache", cache_handler)
+    app.router.add_get("/shards", shards_handler)
+    app.router.add_get("/transitions", transitions_handler)
+    app.router.add_get("/metrics", metrics_handler)
+    app.router.add_get("/debug/profile", profile_handler)
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, "0.0.0.0", int(os.getenv("PORT", 8000)))
+    port = int(os.getenv("PORT", 8000))
+    site = web.TCPSite(runner, "0.0.0.0", port)
     await site.start()
-    logger.info("Health check server started on port 8000")
+    logger.info(f"Health check server started on port {port}")
 
 
 async def self_ping():
     await asyncio.sleep(30)
     port = int(os.getenv("PORT", 8000))
-    async with aiohttp.ClientSession() as session:
-        while True:
-            try:
-                async with session.get(f"http://localhost:{port}/") as resp:
-                    logger.info(f"Self-ping: {resp.status}")
-            except Exception as e:
-                logger.error(f"Self-ping failed: {e}")
-            await asyncio.sleep(300)
+    # One request every five minutes doesn't need a session held open
+    # for the life of the process.
+    while True:
+        try:
+            async with aiohttp.request("GET", f"http://localhost:{port}/") as resp:
+                logger.debug(f"Self-ping: {resp.status}")
+        except Exception as e:
+            logger.error(f"Self-ping failed: {e}")
+        await asyncio.sleep(300)
 
 
 async def main():
+    loop_monitor.start()
     await start_health_server()
     asyncio.create_task(self_ping())
     await bot.start(DISCORD_TOKEN)
 
 
-asyncio.run(main())
+if __name__ == "__main__":
+    asyncio.run(main())
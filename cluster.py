@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+import signal
+import sys
+import time
+
+import aiohttp
+from dotenv import load_dotenv
+
+from logformat import stream_handler
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO, handlers=[stream_handler(os.getenv("LOG_FORMAT", "json"))]
+)
+logger = logging.getLogger("cluster")
+
+DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", os.cpu_count() or 1))
+SHARD_COUNT = os.getenv("SHARD_COUNT")
+BASE_PORT = int(os.getenv("PORT", 8000))
+# Per-worker files; the guild state database is shared, since each worker
+# only restores and deletes rows of guilds on its own shards.
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", "search_cache.db")
+TRACE_PATH = os.getenv("TRACE_PATH")
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+IDENTIFY_INTERVAL = 5
+RESTART_DELAY = 5
+MAX_RESTART_DELAY = 300
+STABLE_RUNTIME = 60
+
+processes: dict[int, asyncio.subprocess.Process] = {}
+stopping = asyncio.Event()
+
+
+async def fetch_gateway() -> tuple[int, int]:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            "https://discord.com/api/v10/gateway/bot",
+            headers={"Authorization": f"Bot {DISCORD_TOKEN}"},
+        ) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+    return data["shards"], data["session_start_limit"]["max_concurrency"]
+
+
+def cluster_path(path: str, cluster_id: int) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.{cluster_id}{ext}"
+
+
+def split_shards(shard_count: int, workers: int) -> list[list[int]]:
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    clusters = []
+    start = 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        clusters.append(list(range(start, end)))
+        start = end
+    return clusters
+
+
+async def run_worker(
+    cluster_id: int, shard_ids: list[int], shard_count: int, start_delay: float
+):
+    await asyncio.sleep(start_delay)
+    env = dict(
+        os.environ,
+        CLUSTER_ID=str(cluster_id),
+        SHARD_COUNT=str(shard_count),
+        SHARD_IDS=",".join(map(str, shard_ids)),
+        PORT=str(BASE_PORT + cluster_id),
+        SEARCH_CACHE_PATH=cluster_path(SEARCH_CACHE_PATH, cluster_id),
+    )
+    if TRACE_PATH:
+        env["TRACE_PATH"] = cluster_path(TRACE_PATH, cluster_id)
+    delay = RESTART_DELAY
+    while not stopping.is_set():
+        started = time.monotonic()
+        proc = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, env=env)
+        processes[cluster_id] = proc
+        logger.info(
+            f"Cluster {cluster_id} started (pid {proc.pid}, shards {shard_ids}, "
+            f"port {BASE_PORT + cluster_id})"
+        )
+        code = await proc.wait()
+        del processes[cluster_id]
+        if stopping.is_set():
+            break
+        if time.monotonic() - started > STABLE_RUNTIME:
+            delay = RESTART_DELAY
+        logger.error(
+            f"Cluster {cluster_id} exited with code {code}, restarting in {delay}s"
+        )
+        try:
+            await asyncio.wait_for(stopping.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        delay = min(delay * 2, MAX_RESTART_DELAY)
+
+
+def shutdown():
+    stopping.set()
+    for proc in processes.values():
+        if proc.returncode is None:
+            proc.terminate()
+
+
+async def main():
+    if SHARD_COUNT:
+        shard_count, max_concurrency = int(SHARD_COUNT), 1
+    else:
+        shard_count, max_concurrency = await fetch_gateway()
+
+    clusters = split_shards(shard_count, CLUSTER_WORKERS)
+    logger.info(f"Launching {shard_count} shards across {len(clusters)} workers")
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, shutdown)
+
+    # Discord only allows max_concurrency identifies per 5 seconds, so later
+    # workers wait for the shards of earlier ones to get through.
+    workers = []
+    launched = 0
+    for cluster_id, shard_ids in enumerate(clusters):
+        start_delay = launched // max_concurrency * IDENTIFY_INTERVAL
+        workers.append(run_worker(cluster_id, shard_ids, shard_count, start_delay))
+        launched += len(shard_ids)
+    await asyncio.gather(*workers)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())